@@ -71,6 +71,21 @@ PROXYAPI_URLS = {
     'deepseek': 'https://api.proxyapi.ru/deepseek',
     'google': 'https://api.proxyapi.ru/google',
 }
+# Размер пула keep-alive соединений на провайдера
+PROXYAPI_POOL_SIZES = {
+    'default': 10,
+    'openai': 20,
+    'anthropic': 20,
+    'deepseek': 10,
+    'google': 10,
+}
+# Провайдер отключается после failure_threshold ошибок подряд на reset_timeout секунд
+PROXYAPI_CIRCUIT_BREAKER = {
+    'failure_threshold': 5,
+    'reset_timeout': 30,
+}
+# Кэш изображений в base64 (на процесс), байт
+IMAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024
 # Кастомная модель пользователя
 AUTH_USER_MODEL = 'accounts.User'
 
@@ -0,0 +1,188 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from .providers import get_adapter
+
+
+class CircuitOpenError(Exception):
+    """Провайдер временно отключен после серии ошибок"""
+
+
+# Отказом провайдера считаются только ошибки соединения и чтения; локальные ошибки
+# (неверный запрос, нехватка соединений в пуле) не должны размыкать предохранитель
+SYNC_PROVIDER_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+ASYNC_PROVIDER_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadError, httpx.ReadTimeout,
+                         httpx.RemoteProtocolError)
+
+
+class CircuitBreaker:
+    """Размыкается после failure_threshold ошибок подряд и пропускает пробный запрос через reset_timeout секунд"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError()
+            # Полуоткрытое состояние: пропускаем один пробный запрос и заново открываем окно, поэтому
+            # остальные запросы до его результата сразу получают CircuitOpenError (503), а не ждут
+            self.opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class ProviderClient:
+    """Общая для процесса сессия провайдера с пулом keep-alive соединений"""
+
+    def __init__(self, provider, pool_size=10, failure_threshold=5, reset_timeout=30):
+        self.provider = provider
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update(_provider_headers(provider))
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+    def post(self, url, payload, timeout=(10, 120), **kwargs):
+        self.breaker.before_request()
+        try:
+            response = self.session.post(url, json=payload, timeout=timeout, **kwargs)
+        except SYNC_PROVIDER_ERRORS:
+            self.breaker.record_failure()
+            raise
+
+        # Ошибки сервера считаются отказом провайдера, ошибки запроса (4xx) - нет
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+
+class AsyncProviderClient:
+    """Асинхронный клиент провайдера (httpx) с пулом keep-alive соединений"""
+
+    def __init__(self, provider, breaker, pool_size=10):
+        self.provider = provider
+        self.breaker = breaker
+        self.client = httpx.AsyncClient(
+            headers=_provider_headers(provider),
+            # Число одновременных запросов не ограничивается (как pool_block=False у requests),
+            # pool_size задает только число сохраняемых keep-alive соединений
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(120, connect=10),
+        )
+
+    async def post(self, url, payload, **kwargs):
+        self.breaker.before_request()
+        try:
+            response = await self.client.post(url, json=payload, **kwargs)
+        except ASYNC_PROVIDER_ERRORS:
+            self.breaker.record_failure()
+            raise
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    async def stream(self, url, payload, **kwargs):
+        """Отправляет запрос и возвращает ответ сразу после заголовков; тело читается потоком.
+
+        Ответ нужно закрыть через await response.aclose().
+        """
+        self.breaker.before_request()
+        request = self.client.build_request('POST', url, json=payload, **kwargs)
+        try:
+            response = await self.client.send(request, stream=True)
+        except ASYNC_PROVIDER_ERRORS:
+            self.breaker.record_failure()
+            raise
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+# Соединения httpx привязаны к циклу событий, поэтому асинхронные клиенты создаются на каждый цикл.
+# Под ASGI цикл один на процесс; клиенты закрытых циклов удаляются при следующем обращении
+_async_clients = {}
+
+
+def _provider_headers(provider):
+    adapter = get_adapter(provider)
+    if adapter is not None:
+        return adapter.headers
+    return {
+        'Authorization': f'Bearer {settings.PROXYAPI_TOKEN}',
+        'Content-Type': 'application/json'
+    }
+
+
+def _provider_settings(provider):
+    pool_sizes = getattr(settings, 'PROXYAPI_POOL_SIZES', {})
+    breaker = getattr(settings, 'PROXYAPI_CIRCUIT_BREAKER', {})
+    return {
+        'pool_size': pool_sizes.get(provider, pool_sizes.get('default', 10)),
+        'failure_threshold': breaker.get('failure_threshold', 5),
+        'reset_timeout': breaker.get('reset_timeout', 30),
+    }
+
+
+def get_client(provider):
+    """Возвращает клиент провайдера, создавая его при первом обращении"""
+    client = _clients.get(provider)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(provider)
+            if client is None:
+                client = ProviderClient(provider, **_provider_settings(provider))
+                _clients[provider] = client
+    return client
+
+
+def get_async_client(provider):
+    """Возвращает асинхронный клиент провайдера для текущего цикла событий.
+
+    Рассчитан на долгоживущий цикл ASGI-сервера: под WSGI каждый async-запрос получает
+    свой цикл, и клиент не переиспользуется (представления в этом случае работают через get_client).
+    """
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        for closed in [other for other in _async_clients if other.is_closed()]:
+            del _async_clients[closed]
+        clients = _async_clients.setdefault(loop, {})
+    client = clients.get(provider)
+    if client is None:
+        # Предохранитель общий: отказы провайдера видны и синхронным, и асинхронным запросам
+        breaker = get_client(provider).breaker
+        client = AsyncProviderClient(provider, breaker, _provider_settings(provider)['pool_size'])
+        clients[provider] = client
+    return client
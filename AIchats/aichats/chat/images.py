@@ -0,0 +1,97 @@
+import base64
+import io
+import mimetypes
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from .models import ChatImage
+
+
+class EncodedImageCache:
+    """LRU-кэш изображений (MIME-тип, base64) по ChatImage.id, ограниченный суммарным размером в байтах"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, image_id):
+        with self._lock:
+            value = self._items.get(image_id)
+            if value is not None:
+                self._items.move_to_end(image_id)
+            return value
+
+    def put(self, image_id, media_type, image_base64):
+        # Изображение больше всего кэша не сохраняем, чтобы не вытеснять остальные
+        if len(image_base64) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(image_id, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self._items[image_id] = (media_type, image_base64)
+            self.size += len(image_base64)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+
+_cache = EncodedImageCache(getattr(settings, 'IMAGE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+
+def get_encoded_image(image_id):
+    """Возвращает (MIME-тип, base64) изображения, читая и кодируя файл только при промахе кэша.
+
+    Загрузки пережимаются в JPEG, но файлы, сохраненные как есть (без Pillow или до пережатия),
+    получают свой настоящий тип. Бросает ChatImage.DoesNotExist, если изображения нет.
+    """
+    key = int(image_id)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+
+    chat_image = ChatImage.objects.get(id=key)
+    media_type = mimetypes.guess_type(chat_image.image.name)[0] or 'image/jpeg'
+    with open(chat_image.image.path, 'rb') as img_file:
+        image_base64 = base64.b64encode(img_file.read()).decode()
+    _cache.put(key, media_type, image_base64)
+    return media_type, image_base64
+
+
+def shrink_image(image_file, max_size, quality=85):
+    """Уменьшает изображение до max_size пикселей по длинной стороне и всегда пережимает в JPEG,
+    чтобы тип файла совпадал с тем, что отправляется провайдерам.
+
+    Возвращает ContentFile или None, если файл не удалось обработать (тогда сохраняется оригинал).
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+
+    try:
+        image = Image.open(image_file)
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            # Прозрачность заменяем белым фоном: JPEG ее не поддерживает
+            background = Image.new('RGB', image.size, 'white')
+            rgba = image.convert('RGBA')
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            image = background
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=quality, optimize=True)
+    except Exception as e:
+        print(f"Не удалось уменьшить изображение: {str(e)}")
+        return None
+    finally:
+        image_file.seek(0)
+
+    name = image_file.name.rsplit('.', 1)[0] + '.jpg'
+    return ContentFile(output.getvalue(), name=name)
@@ -0,0 +1,206 @@
+import json
+
+from django.conf import settings
+
+
+class ProviderAdapter:
+    """Адаптер провайдера: сборка запроса, разбор ответа, потоковый режим и изображения.
+
+    Базовый класс реализует OpenAI-совместимый API (/chat/completions).
+    """
+
+    supports_images = True
+    # Наибольшая сторона изображения в пикселях, которую провайдер использует без уменьшения
+    max_image_size = 2048
+
+    def __init__(self, name, base_url):
+        self.name = name
+        self.base_url = base_url
+        # Статические заголовки и адрес считаются один раз при создании адаптера
+        self.headers = {
+            'Authorization': f'Bearer {settings.PROXYAPI_TOKEN}',
+            'Content-Type': 'application/json'
+        }
+        self.chat_url = f'{base_url}/chat/completions'
+
+    def endpoint(self, model):
+        return self.chat_url
+
+    def encode_image(self, content, image_base64, media_type='image/jpeg'):
+        """Добавляет изображение к содержимому пользовательского сообщения"""
+        return [
+            {"type": "text", "text": content},
+            {"type": "image_url", "image_url": {"url": f"data:{media_type};base64,{image_base64}"}}
+        ]
+
+    def attach_image(self, messages, image_base64, media_type='image/jpeg'):
+        if image_base64 and self.supports_images and messages and messages[-1]['role'] == 'user':
+            messages[-1] = dict(messages[-1],
+                                content=self.encode_image(messages[-1]['content'], image_base64, media_type))
+        return messages
+
+    def build_payload(self, model, messages, image_base64=None, media_type='image/jpeg'):
+        """Собирает тело запроса; messages - история в формате OpenAI, системное сообщение первым"""
+        return {
+            'model': model.api_name,
+            'messages': self.attach_image(list(messages), image_base64, media_type),
+            'max_tokens': 4000,
+            'temperature': 0.7
+        }
+
+    def extract_text(self, result):
+        return result['choices'][0]['message']['content']
+
+    def stream_request(self, model, payload):
+        """Возвращает (endpoint, payload) для потокового (SSE) ответа"""
+        return self.endpoint(model), dict(payload, stream=True)
+
+    def parse_stream_event(self, data):
+        """Разбирает поле data одного события SSE; возвращает (текст, поток завершен)"""
+        if data == '[DONE]':
+            return None, True
+        event = json.loads(data)
+        for choice in event.get('choices', [])[:1]:
+            return choice.get('delta', {}).get('content'), False
+        return None, False
+
+
+class DeepSeekAdapter(ProviderAdapter):
+    """DeepSeek: OpenAI-совместимый API без поддержки изображений"""
+
+    supports_images = False
+
+
+class AnthropicAdapter(ProviderAdapter):
+    """Anthropic Messages API"""
+
+    max_image_size = 1568
+
+    def __init__(self, name, base_url):
+        super().__init__(name, base_url)
+        self.chat_url = f'{base_url}/v1/messages'
+
+    def encode_image(self, content, image_base64, media_type='image/jpeg'):
+        return [
+            {"type": "text", "text": content},
+            {"type": "image",
+             "source": {"type": "base64", "media_type": media_type, "data": image_base64}}
+        ]
+
+    def build_payload(self, model, messages, image_base64=None, media_type='image/jpeg'):
+        # Системное сообщение передается отдельным полем
+        claude_messages = []
+        system_content = None
+        for msg in messages:
+            if msg['role'] == 'system':
+                system_content = msg['content']
+            else:
+                claude_messages.append(msg)
+
+        payload = {
+            'model': model.api_name,
+            'messages': self.attach_image(claude_messages, image_base64, media_type),
+            'max_tokens': 4000
+        }
+        if system_content:
+            payload['system'] = system_content
+        return payload
+
+    def extract_text(self, result):
+        return result['content'][0]['text']
+
+    def parse_stream_event(self, data):
+        event = json.loads(data)
+        event_type = event.get('type')
+        if event_type == 'content_block_delta':
+            return event['delta'].get('text'), False
+        if event_type == 'message_stop':
+            return None, True
+        if event_type == 'error':
+            raise RuntimeError(event.get('error', {}).get('message', 'Ошибка потока'))
+        return None, False
+
+
+class GoogleAdapter(ProviderAdapter):
+    """Google Gemini API (generateContent)"""
+
+    max_image_size = 3072
+
+    def __init__(self, name, base_url):
+        super().__init__(name, base_url)
+        self.models_url = f'{base_url}/v1/models'
+
+    def endpoint(self, model):
+        return f'{self.models_url}/{model.api_name}:generateContent'
+
+    def encode_image(self, content, image_base64, media_type='image/jpeg'):
+        return content + [{"inline_data": {"mime_type": media_type, "data": image_base64}}]
+
+    def build_payload(self, model, messages, image_base64=None, media_type='image/jpeg'):
+        gemini_contents = []
+        for msg in messages:
+            if msg['role'] == 'user':
+                gemini_contents.append({"role": "user", "parts": [{"text": msg['content']}]})
+            elif msg['role'] == 'assistant':
+                gemini_contents.append({"role": "model", "parts": [{"text": msg['content']}]})
+
+        if image_base64 and gemini_contents and gemini_contents[-1]['role'] == 'user':
+            gemini_contents[-1]['parts'] = self.encode_image(gemini_contents[-1]['parts'], image_base64, media_type)
+        return {'contents': gemini_contents}
+
+    def extract_text(self, result):
+        if 'candidates' in result and len(result['candidates']) > 0:
+            candidate = result['candidates'][0]
+            if 'content' in candidate and 'parts' in candidate['content'] and len(
+                    candidate['content']['parts']) > 0:
+                return candidate['content']['parts'][0]['text']
+            return str(candidate.get('content', result))
+        return str(result)
+
+    def stream_request(self, model, payload):
+        return f'{self.models_url}/{model.api_name}:streamGenerateContent?alt=sse', payload
+
+    def parse_stream_event(self, data):
+        # У Gemini нет отдельного события конца потока: признак - finishReason кандидата
+        event = json.loads(data)
+        for candidate in event.get('candidates', [])[:1]:
+            text = ''.join(part.get('text', '') for part in candidate.get('content', {}).get('parts', []))
+            return text or None, bool(candidate.get('finishReason'))
+        return None, False
+
+
+# Классы адаптеров по имени провайдера; адреса берутся из settings.PROXYAPI_URLS
+_adapter_classes = {
+    'openai': ProviderAdapter,
+    'deepseek': DeepSeekAdapter,
+    'anthropic': AnthropicAdapter,
+    'google': GoogleAdapter,
+}
+_adapters = {}
+
+
+def register_provider(name, adapter_class=ProviderAdapter, base_url=None):
+    """Регистрирует провайдера; base_url по умолчанию берется из settings.PROXYAPI_URLS"""
+    _adapter_classes[name] = adapter_class
+    base_url = base_url or settings.PROXYAPI_URLS.get(name)
+    if base_url:
+        _adapters[name] = adapter_class(name, base_url)
+
+
+def load_adapters():
+    """Создает адаптеры всех провайдеров из settings.PROXYAPI_URLS (вызывается при старте)"""
+    _adapters.clear()
+    for name, base_url in settings.PROXYAPI_URLS.items():
+        adapter_class = _adapter_classes.get(name, ProviderAdapter)
+        _adapters[name] = adapter_class(name, base_url)
+
+
+def get_adapter(provider):
+    """Возвращает адаптер провайдера или None, если провайдер не настроен"""
+    return _adapters.get(provider)
+
+
+def max_image_size():
+    """Наибольшая сторона изображения, подходящая всем провайдерам с поддержкой изображений"""
+    sizes = [adapter.max_image_size for adapter in _adapters.values() if adapter.supports_images]
+    return min(sizes) if sizes else ProviderAdapter.max_image_size
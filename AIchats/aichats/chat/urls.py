@@ -4,5 +4,7 @@ from . import views
 urlpatterns = [
     path('', views.index, name='index'),
     path('api/chat/', views.chat_api, name='chat_api'),
+    path('api/chat/async/', views.chat_api_async, name='chat_api_async'),
+    path('api/chat/stream/', views.chat_api_stream, name='chat_api_stream'),
     path('upload-image/', views.upload_image, name='upload_image'),
 ]
\ No newline at end of file
@@ -1,14 +1,19 @@
 import json
 import requests
+import httpx
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from .models import AIModel, Assistant
 from accounts.models import Transaction
+from .clients import get_client, get_async_client, CircuitOpenError
+from .providers import get_adapter, max_image_size
+from .images import get_encoded_image, shrink_image
 
-import base64
 from .models import AIModel, Assistant, ChatImage
 
 
@@ -21,196 +26,138 @@ def index(request):
     })
 
 
-@csrf_exempt
-def chat_api(request):
+def _prepare_chat(request):
+    """Проверяет запрос и собирает endpoint и payload для провайдера модели.
+
+    Возвращает (ответ с ошибкой, None) или (None, данные запроса).
+    """
     if not request.user.is_authenticated:
-        return JsonResponse({'error': 'Необходима авторизация'}, status=401)
+        return JsonResponse({'error': 'Необходима авторизация'}, status=401), None
 
     if not request.user.can_send_message():
         return JsonResponse({
             'error': 'Недостаточно средств. Пополните баланс или используйте бесплатные сообщения.',
             'need_payment': True
-        }, status=402)
+        }, status=402), None
 
     if request.method != 'POST':
-        return JsonResponse({'error': 'Method not allowed'}, status=405)
+        return JsonResponse({'error': 'Method not allowed'}, status=405), None
 
-    try:
-        data = json.loads(request.body)
-        messages = data.get('messages', [])
-        model_id = data.get('model_id')
-        assistant_id = data.get('assistant_id')
-        image_id = data.get('image_id')
+    data = json.loads(request.body)
+    messages = data.get('messages', [])
+    model_id = data.get('model_id')
+    assistant_id = data.get('assistant_id')
+    image_id = data.get('image_id')
 
-        # Поддержка старого формата
-        if not messages and data.get('message'):
-            messages = [{'role': 'user', 'content': data.get('message')}]
+    # Поддержка старого формата
+    if not messages and data.get('message'):
+        messages = [{'role': 'user', 'content': data.get('message')}]
 
-        print(
-            f"Получен запрос: model_id={model_id}, assistant_id={assistant_id}, messages={len(messages)}, image_id={image_id}")
+    print(
+        f"Получен запрос: model_id={model_id}, assistant_id={assistant_id}, messages={len(messages)}, image_id={image_id}")
 
-        if not messages:
-            return JsonResponse({'error': 'Сообщения не могут быть пустыми'}, status=400)
+    if not messages:
+        return JsonResponse({'error': 'Сообщения не могут быть пустыми'}, status=400), None
 
-        # Получаем модель и ассистента
+    # Получаем модель и ассистента
+    try:
+        model = AIModel.objects.get(id=model_id, is_active=True)
+        print(f"Найдена модель: {model.name} ({model.api_name})")
+    except AIModel.DoesNotExist:
+        return JsonResponse({'error': 'Модель не найдена'}, status=400), None
+
+    assistant = None
+    if assistant_id:
+        try:
+            assistant = Assistant.objects.get(id=assistant_id, is_active=True)
+            print(f"Найден ассистент: {assistant.name}")
+        except Assistant.DoesNotExist:
+            pass
+
+    # Формируем сообщения для API
+    api_messages = []
+
+    # Добавляем системное сообщение ассистента если есть
+    if assistant:
+        api_messages.append({
+            "role": "system",
+            "content": assistant.get_full_prompt()
+        })
+
+    # Добавляем историю разговора
+    for msg in messages:
+        api_messages.append(msg)
+
+    adapter = get_adapter(model.provider)
+    if adapter is None:
+        return JsonResponse({'error': f'Неподдерживаемый провайдер: {model.provider}'}, status=400), None
+
+    # Обрабатываем изображение если есть
+    image_base64 = None
+    media_type = 'image/jpeg'
+    if image_id and adapter.supports_images:
         try:
-            model = AIModel.objects.get(id=model_id, is_active=True)
-            print(f"Найдена модель: {model.name} ({model.api_name})")
-        except AIModel.DoesNotExist:
-            return JsonResponse({'error': 'Модель не найдена'}, status=400)
+            media_type, image_base64 = get_encoded_image(image_id)
+        except ChatImage.DoesNotExist:
+            print("Изображение не найдено")
+        except Exception as e:
+            print(f"Ошибка обработки изображения: {str(e)}")
 
-        assistant = None
-        if assistant_id:
-            try:
-                assistant = Assistant.objects.get(id=assistant_id, is_active=True)
-                print(f"Найден ассистент: {assistant.name}")
-            except Assistant.DoesNotExist:
-                pass
-
-        # Формируем сообщения для API
-        api_messages = []
-
-        # Добавляем системное сообщение ассистента если есть
-        if assistant:
-            api_messages.append({
-                "role": "system",
-                "content": assistant.get_full_prompt()
-            })
+    print(f"Провайдер модели: '{model.provider}' ({adapter.base_url})")
 
-        # Добавляем историю разговора
-        for msg in messages:
-            api_messages.append(msg)
+    payload = adapter.build_payload(model, api_messages, image_base64, media_type)
+    endpoint = adapter.endpoint(model)
 
-        # Обрабатываем изображение если есть
-        if image_id:
-            try:
-                chat_image = ChatImage.objects.get(id=image_id)
-                with open(chat_image.image.path, 'rb') as img_file:
-                    image_base64 = base64.b64encode(img_file.read()).decode()
-
-                # Модифицируем последнее пользовательское сообщение
-                if api_messages and api_messages[-1]['role'] == 'user':
-                    original_content = api_messages[-1]['content']
-
-                    if model.provider == 'openai':
-                        api_messages[-1]['content'] = [
-                            {"type": "text", "text": original_content},
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}}
-                        ]
-                    elif model.provider == 'anthropic':
-                        api_messages[-1]['content'] = [
-                            {"type": "text", "text": original_content},
-                            {"type": "image",
-                             "source": {"type": "base64", "media_type": "image/jpeg", "data": image_base64}}
-                        ]
-
-            except ChatImage.DoesNotExist:
-                print("Изображение не найдено")
-                pass
-            except Exception as e:
-                print(f"Ошибка обработки изображения: {str(e)}")
-                pass
-
-        # Получаем URL для провайдера
-        provider_urls = {
-            'openai': 'https://api.proxyapi.ru/openai/v1',
-            'anthropic': 'https://api.proxyapi.ru/anthropic',
-            'deepseek': 'https://api.proxyapi.ru/deepseek',
-            'google': 'https://api.proxyapi.ru/google',
-        }
-
-        base_url = provider_urls.get(model.provider)
-        if not base_url:
-            return JsonResponse({'error': f'Неподдерживаемый провайдер: {model.provider}'}, status=400)
-
-        print(f"Используем URL: {base_url}")
-        print(f"Провайдер модели: '{model.provider}'")
-        print(f"Токен: {settings.PROXYAPI_TOKEN[:10]}...")
-
-        # Отправляем запрос к API в зависимости от провайдера
-        headers = {
-            'Authorization': f'Bearer {settings.PROXYAPI_TOKEN}',
-            'Content-Type': 'application/json'
-        }
-
-        if model.provider == 'anthropic':
-            print("Используем Anthropic API")
-            claude_messages = []
-            system_content = None
-
-            for msg in api_messages:
-                if msg['role'] == 'system':
-                    system_content = msg['content']
-                else:
-                    claude_messages.append(msg)
-
-            payload = {
-                'model': model.api_name,
-                'messages': claude_messages,
-                'max_tokens': 4000
-            }
-
-            if system_content:
-                payload['system'] = system_content
-
-            endpoint = f'{base_url}/v1/messages'
-
-        elif model.provider == 'google':
-            print("Используем Google Gemini API")
-            gemini_contents = []
-
-            for msg in api_messages:
-                if msg['role'] == 'user':
-                    parts = [{"text": msg['content']}]
-
-                    # Добавляем изображение для Gemini
-                    if image_id:
-                        try:
-                            chat_image = ChatImage.objects.get(id=image_id)
-                            with open(chat_image.image.path, 'rb') as img_file:
-                                image_base64 = base64.b64encode(img_file.read()).decode()
-                            parts.append({
-                                "inline_data": {
-                                    "mime_type": "image/jpeg",
-                                    "data": image_base64
-                                }
-                            })
-                        except ChatImage.DoesNotExist:
-                            pass
-
-                    gemini_contents.append({"parts": parts})
-                elif msg['role'] == 'assistant':
-                    gemini_contents.append({
-                        "role": "model",
-                        "parts": [{"text": msg['content']}]
-                    })
-
-            payload = {'contents': gemini_contents}
-            endpoint = f'{base_url}/v1/models/{model.api_name}:generateContent'
+    print(f"Отправляем запрос к {endpoint}")
+    return None, {'model': model, 'adapter': adapter, 'image_id': image_id, 'endpoint': endpoint, 'payload': payload}
 
-        else:
-            print("Используем OpenAI/DeepSeek API")
-            payload = {
-                'model': model.api_name,
-                'messages': api_messages,
-                'max_tokens': 4000,
-                'temperature': 0.7
-            }
-            endpoint = f'{base_url}/chat/completions'
-
-        print(f"Отправляем запрос к {endpoint}")
-
-        # Делаем запрос с увеличенным таймаутом и повторными попытками
+
+def _charge_chat(request, image_id):
+    """Списывает стоимость сообщения и создает транзакцию"""
+    request.user.charge_for_message()
+
+    # Создаем транзакцию
+    if request.user.get_available_messages() >= 0:
+        Transaction.objects.create(
+            user=request.user,
+            transaction_type='message',
+            amount=0,
+            description='Бесплатное сообщение с изображением' if image_id else 'Бесплатное сообщение'
+        )
+    else:
+        Transaction.objects.create(
+            user=request.user,
+            transaction_type='message',
+            amount=settings.MESSAGE_PRICE,
+            description='Платное сообщение с изображением' if image_id else 'Платное сообщение'
+        )
+
+
+def _complete_chat(request, adapter, image_id, result):
+    """Списывает стоимость сообщения и извлекает текст ответа провайдера"""
+    _charge_chat(request, image_id)
+    return adapter.extract_text(result)
+
+
+@csrf_exempt
+def chat_api(request):
+    try:
+        error, chat = _prepare_chat(request)
+        if error:
+            return error
+        model = chat['model']
+
+        # Делаем запрос через общий пул соединений провайдера с повторными попытками
+        client = get_client(model.provider)
         max_retries = 2
         for attempt in range(max_retries + 1):
             try:
-                response = requests.post(
-                    endpoint,
-                    headers=headers,
-                    json=payload,
-                    timeout=(10, 120)
-                )
+                response = client.post(chat['endpoint'], chat['payload'], timeout=(10, 120))
                 break
+            except CircuitOpenError:
+                return JsonResponse(
+                    {'error': 'Сервер ИИ временно недоступен. Попробуйте позже или выберите другую модель.'},
+                    status=503)
             except requests.exceptions.Timeout as e:
                 print(f"Таймаут на попытке {attempt + 1}: {str(e)}")
                 if attempt == max_retries:
@@ -227,42 +174,7 @@ def chat_api(request):
         print(f"Содержимое ответа: {response.text[:200]}...")
 
         if response.status_code == 200:
-            result = response.json()
-
-            # Списываем стоимость сообщения
-            request.user.charge_for_message()
-
-            # Создаем транзакцию
-            if request.user.get_available_messages() >= 0:
-                Transaction.objects.create(
-                    user=request.user,
-                    transaction_type='message',
-                    amount=0,
-                    description='Бесплатное сообщение с изображением' if image_id else 'Бесплатное сообщение'
-                )
-            else:
-                Transaction.objects.create(
-                    user=request.user,
-                    transaction_type='message',
-                    amount=settings.MESSAGE_PRICE,
-                    description='Платное сообщение с изображением' if image_id else 'Платное сообщение'
-                )
-
-            if model.provider == 'anthropic':
-                ai_response = result['content'][0]['text']
-            elif model.provider == 'google':
-                if 'candidates' in result and len(result['candidates']) > 0:
-                    candidate = result['candidates'][0]
-                    if 'content' in candidate and 'parts' in candidate['content'] and len(
-                            candidate['content']['parts']) > 0:
-                        ai_response = candidate['content']['parts'][0]['text']
-                    else:
-                        ai_response = str(candidate.get('content', result))
-                else:
-                    ai_response = str(result)
-            else:
-                ai_response = result['choices'][0]['message']['content']
-
+            ai_response = _complete_chat(request, chat['adapter'], chat['image_id'], response.json())
             return JsonResponse({'response': ai_response})
         else:
             error_text = response.text
@@ -277,6 +189,248 @@ def chat_api(request):
         traceback.print_exc()
         return JsonResponse({'error': str(e)}, status=500)
 
+
+async def chat_api_async(request):
+    """Асинхронная версия chat_api: ожидание ответа модели не занимает поток воркера.
+
+    Выигрыш есть только под ASGI-сервером; под WSGI запрос выполняется синхронным chat_api.
+    """
+    if not isinstance(request, ASGIRequest):
+        # Под WSGI у каждого запроса свой цикл событий, пул httpx не переиспользовался бы
+        return await sync_to_async(chat_api)(request)
+
+    try:
+        # Проверки, запросы к БД и чтение изображения выполняются в потоке
+        error, chat = await sync_to_async(_prepare_chat)(request)
+        if error:
+            return error
+        model = chat['model']
+
+        client = get_async_client(model.provider)
+        max_retries = 2
+        for attempt in range(max_retries + 1):
+            try:
+                response = await client.post(chat['endpoint'], chat['payload'])
+                break
+            except CircuitOpenError:
+                return JsonResponse(
+                    {'error': 'Сервер ИИ временно недоступен. Попробуйте позже или выберите другую модель.'},
+                    status=503)
+            except httpx.TimeoutException as e:
+                print(f"Таймаут на попытке {attempt + 1}: {str(e)}")
+                if attempt == max_retries:
+                    return JsonResponse(
+                        {'error': 'Сервер ИИ не отвечает. Попробуйте позже или выберите другую модель.'}, status=500)
+                continue
+            except httpx.HTTPError as e:
+                print(f"Ошибка запроса на попытке {attempt + 1}: {str(e)}")
+                if attempt == max_retries:
+                    return JsonResponse({'error': f'Ошибка соединения: {str(e)}'}, status=500)
+                continue
+
+        print(f"Статус ответа: {response.status_code}")
+        print(f"Содержимое ответа: {response.text[:200]}...")
+
+        if response.status_code == 200:
+            ai_response = await sync_to_async(_complete_chat)(request, chat['adapter'], chat['image_id'], response.json())
+            return JsonResponse({'response': ai_response})
+        else:
+            print(f"Ошибка API: {response.text}")
+            return JsonResponse({'error': f'Ошибка API: {response.status_code}'}, status=500)
+
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Неверный JSON'}, status=400)
+    except Exception as e:
+        print(f"Исключение: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+# csrf_exempt в Django 4.2 не поддерживает async-представления, поэтому флаг ставится напрямую
+chat_api_async.csrf_exempt = True
+
+
+def _sse_data(line):
+    """Поле data строки SSE провайдера или None"""
+    if not line.startswith('data:'):
+        return None
+    return line[5:].strip() or None
+
+
+def _stream_tokens_sync(adapter, response):
+    """Читает SSE провайдера (requests) и отдает фрагменты текста.
+
+    Возвращает управление только после штатного завершения потока;
+    оборванный поток или событие ошибки приводят к исключению.
+    """
+    finished = False
+    for line in response.iter_lines():
+        data = _sse_data(line.decode('utf-8'))
+        if data is None:
+            continue
+
+        text, done = adapter.parse_stream_event(data)
+        if text:
+            yield text
+        finished = finished or done
+
+    if not finished:
+        raise RuntimeError('Поток ответа прерван')
+
+
+async def _stream_tokens(adapter, response):
+    """Асинхронный вариант _stream_tokens_sync (httpx)"""
+    finished = False
+    async for line in response.aiter_lines():
+        data = _sse_data(line)
+        if data is None:
+            continue
+
+        text, done = adapter.parse_stream_event(data)
+        if text:
+            yield text
+        finished = finished or done
+
+    if not finished:
+        raise RuntimeError('Поток ответа прерван')
+
+
+def _sse(data, event=None):
+    """Форматирует событие Server-Sent Events"""
+    prefix = f'event: {event}\n' if event else ''
+    return f'{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+def _stream_events_sync(request, chat, endpoint, payload):
+    """События SSE для WSGI: поток провайдера читается через общий пул requests"""
+    client = get_client(chat['model'].provider)
+
+    # Повторы возможны только до начала передачи: после первого токена поток не перезапускается
+    max_retries = 2
+    for attempt in range(max_retries + 1):
+        try:
+            response = client.post(endpoint, payload, timeout=(10, 120), stream=True)
+            break
+        except CircuitOpenError:
+            yield _sse({'error': 'Сервер ИИ временно недоступен. Попробуйте позже или выберите другую модель.'},
+                       event='error')
+            return
+        except requests.exceptions.Timeout as e:
+            print(f"Таймаут на попытке {attempt + 1}: {str(e)}")
+            if attempt == max_retries:
+                yield _sse({'error': 'Сервер ИИ не отвечает. Попробуйте позже или выберите другую модель.'},
+                           event='error')
+                return
+        except requests.exceptions.RequestException as e:
+            print(f"Ошибка запроса на попытке {attempt + 1}: {str(e)}")
+            if attempt == max_retries:
+                yield _sse({'error': f'Ошибка соединения: {str(e)}'}, event='error')
+                return
+
+    try:
+        print(f"Статус ответа: {response.status_code}")
+        if response.status_code != 200:
+            print(f"Ошибка API: {response.text}")
+            yield _sse({'error': f'Ошибка API: {response.status_code}'}, event='error')
+            return
+
+        for token in _stream_tokens_sync(chat['adapter'], response):
+            yield _sse({'token': token})
+    except Exception as e:
+        print(f"Ошибка потока: {str(e)}")
+        yield _sse({'error': str(e)}, event='error')
+        return
+    finally:
+        response.close()
+
+    # Оплата только за полностью полученный ответ
+    _charge_chat(request, chat['image_id'])
+    yield _sse({}, event='done')
+
+
+async def _stream_events_async(request, chat, endpoint, payload):
+    """События SSE для ASGI: поток провайдера открывается в том же цикле событий, что его читает"""
+    client = get_async_client(chat['model'].provider)
+
+    max_retries = 2
+    for attempt in range(max_retries + 1):
+        try:
+            response = await client.stream(endpoint, payload)
+            break
+        except CircuitOpenError:
+            yield _sse({'error': 'Сервер ИИ временно недоступен. Попробуйте позже или выберите другую модель.'},
+                       event='error')
+            return
+        except httpx.TimeoutException as e:
+            print(f"Таймаут на попытке {attempt + 1}: {str(e)}")
+            if attempt == max_retries:
+                yield _sse({'error': 'Сервер ИИ не отвечает. Попробуйте позже или выберите другую модель.'},
+                           event='error')
+                return
+        except httpx.HTTPError as e:
+            print(f"Ошибка запроса на попытке {attempt + 1}: {str(e)}")
+            if attempt == max_retries:
+                yield _sse({'error': f'Ошибка соединения: {str(e)}'}, event='error')
+                return
+
+    try:
+        print(f"Статус ответа: {response.status_code}")
+        if response.status_code != 200:
+            await response.aread()
+            print(f"Ошибка API: {response.text}")
+            yield _sse({'error': f'Ошибка API: {response.status_code}'}, event='error')
+            return
+
+        async for token in _stream_tokens(chat['adapter'], response):
+            yield _sse({'token': token})
+    except Exception as e:
+        print(f"Ошибка потока: {str(e)}")
+        yield _sse({'error': str(e)}, event='error')
+        return
+    finally:
+        await response.aclose()
+
+    await sync_to_async(_charge_chat)(request, chat['image_id'])
+    yield _sse({}, event='done')
+
+
+@csrf_exempt
+def chat_api_stream(request):
+    """Потоковая версия chat_api: токены передаются клиенту как Server-Sent Events.
+
+    События: data: {"token": ...} на каждый фрагмент, event: done в конце
+    и event: error при сбое (в том числе при недоступности провайдера).
+    Сообщение оплачивается один раз после завершения потока.
+
+    Под WSGI (runserver, gunicorn) поток читается синхронно и занимает поток воркера
+    до конца ответа; под ASGI (uvicorn) - асинхронно, без отдельного потока на запрос.
+    """
+    try:
+        error, chat = _prepare_chat(request)
+        if error:
+            return error
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Неверный JSON'}, status=400)
+    except Exception as e:
+        print(f"Исключение: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return JsonResponse({'error': str(e)}, status=500)
+
+    endpoint, payload = chat['adapter'].stream_request(chat['model'], chat['payload'])
+    # Итератор должен соответствовать серверу: иначе Django собирает весь ответ в память перед отправкой
+    if isinstance(request, ASGIRequest):
+        events = _stream_events_async(request, chat, endpoint, payload)
+    else:
+        events = _stream_events_sync(request, chat, endpoint, payload)
+
+    stream = StreamingHttpResponse(events, content_type='text/event-stream')
+    stream['Cache-Control'] = 'no-cache'
+    stream['X-Accel-Buffering'] = 'no'
+    return stream
+
+
 @csrf_exempt
 def upload_image(request):
     if not request.user.is_authenticated:
@@ -294,6 +448,9 @@ def upload_image(request):
             if image_file.content_type not in allowed_types:
                 return JsonResponse({'error': 'Неподдерживаемый тип файла'}, status=400)
 
+            # Уменьшаем до разрешения, которое провайдеры все равно используют, чтобы не гонять лишние мегабайты
+            image_file = shrink_image(image_file, max_image_size()) or image_file
+
             image = ChatImage.objects.create(image=image_file)
             return JsonResponse({
                 'success': True,
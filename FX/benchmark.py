@@ -0,0 +1,234 @@
+"""Offline benchmarks for SimpleOptionsProcessor on synthetic CME/CFTC data.
+
+Usage: python benchmark.py [--sizes 100 1000 10000] [--cftc-sizes 1000 10000 60000] [--repeat 3]
+                           [--output bench.jsonl]
+
+Synthetic CME exports mimic the real layout (futures block, option type header, call/put
+blocks closed by TOTALS, further series after them). Writing XLS fixtures needs the optional
+xlwt package and is limited to 65536 rows; cases that cannot be written are skipped.
+"""
+import os
+import json
+import random
+import argparse
+import datetime
+import logging
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from openpyxl import Workbook
+
+from main import SimpleOptionsProcessor, INSTRUMENTS_PATH, load_instruments, logger
+
+OPTION_TYPE = 'OPTION TYPE: Monthly Options'
+STRIKE_HEADER = ('Strike', 'Globex', 'Open OutCry', 'Clear Port', 'Total Volume', 'Block Trades',
+                 'EOO', 'Exercises', 'At Close', 'Change')
+CFTC_MARKETS = [info['cftc_market'] for info in load_instruments(INSTRUMENTS_PATH).values() if 'cftc_market' in info]
+XLS_MAX_ROWS = 65536
+
+
+def make_cme_rows(strikes: int, extra_series: int = 2, seed: int = 0) -> List[tuple]:
+    """Build the rows of a synthetic CME options export with `strikes` rows per call/put block"""
+    rng = random.Random(seed)
+    rows = [(None,) * 10] * 4
+    rows.append(('Futures',) + (None,) * 9)
+    rows.append(('TOTALS', '1,000', '0', '0', '1,000', '0', '0', '0', '0', '0'))
+    rows.append((None,) * 10)
+    rows.append((OPTION_TYPE,) + (None,) * 9)
+
+    def block(label: str):
+        rows.append((label,) + (None,) * 9)
+        rows.append(STRIKE_HEADER)
+        for i in range(strikes):
+            at_close = rng.randint(0, 20000)
+            change = rng.randint(-500, 500)
+            rows.append((str(9000 + i * 5), '0', '0', '0', '0', '0', '0', '0',
+                         f"{at_close:,}", f"{change:,}"))
+        rows.append(('TOTALS', '0', '0', '0', '0', '0', '0', '0', '0', '0'))
+        rows.append((None,) * 10)
+
+    for series in range(1 + extra_series):
+        block(f"SER {series} Calls")
+        block(f"SER {series} Puts")
+    return rows
+
+
+def write_cme_xlsx(rows: List[tuple], path: Path):
+    """Write synthetic rows as an XLSX workbook"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    for row in rows:
+        ws.append(row)
+    wb.save(str(path))
+
+
+def write_cme_xls(rows: List[tuple], path: Path) -> bool:
+    """Write synthetic rows as an XLS workbook (requires xlwt, at most 65536 rows)"""
+    try:
+        import xlwt
+    except ImportError:
+        return False
+
+    if len(rows) > XLS_MAX_ROWS:
+        return False
+
+    wb = xlwt.Workbook()
+    ws = wb.add_sheet('Sheet1')
+    for r, row in enumerate(rows):
+        for c, value in enumerate(row):
+            if value is not None:
+                ws.write(r, c, value)
+    wb.save(str(path))
+    return True
+
+
+def write_cftc_zip(rows: int, path: Path, seed: int = 0) -> bool:
+    """Write a synthetic yearly CFTC archive with `rows` report rows (requires xlwt)"""
+    try:
+        import xlwt
+    except ImportError:
+        return False
+
+    rng = random.Random(seed)
+    markets = CFTC_MARKETS + [f"OTHER MARKET {i} - ICE FUTURES U.S." for i in range(60)]
+    wb = xlwt.Workbook()
+    ws = wb.add_sheet('XLS')
+    header = ['Market_and_Exchange_Names', 'As_of_Date_In_Form_YYMMDD', 'Report_Date_as_MM_DD_YYYY',
+              'CFTC_Contract_Market_Code', 'CFTC_Market_Code', 'CFTC_Region_Code', 'CFTC_Commodity_Code',
+              'Open_Interest_All', 'Dealer_Positions_Long_All', 'Dealer_Positions_Short_All']
+    for c, name in enumerate(header):
+        ws.write(0, c, name)
+
+    date = datetime.date(2025, 1, 7)
+    for r in range(1, rows + 1):
+        market = markets[(r - 1) % len(markets)]
+        if r > 1 and (r - 1) % len(markets) == 0:
+            date += datetime.timedelta(days=7)
+        values = [market, int(date.strftime('%y%m%d')), date.strftime('%m/%d/%Y'), '000000', 'CME', '0', '0',
+                  rng.randint(0, 500000), rng.randint(0, 100000), rng.randint(0, 100000)]
+        for c, value in enumerate(values):
+            ws.write(r, c, value)
+
+    xls_path = path.with_name('FinFutYY.xls')
+    wb.save(str(xls_path))
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.write(xls_path, xls_path.name)
+    xls_path.unlink()
+    return True
+
+
+def measure(func: Callable, repeat: int, setup: Optional[Callable] = None) -> Dict:
+    """Best wall time over `repeat` runs and the tracemalloc peak of one run"""
+    best = float('inf')
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'seconds': best, 'peak_mb': peak / (1024 * 1024)}
+
+
+def run(sizes: List[int], cftc_sizes: List[int], repeat: int, workdir: Path) -> List[Dict]:
+    """Run all benchmark cases and return one result per case"""
+    os.chdir(workdir)
+    processor = SimpleOptionsProcessor()
+    processor.output_path = workdir / 'output'
+    processor.output_path.mkdir(exist_ok=True)
+    results = []
+
+    def add(case: str, size: int, rows: int, stats: Dict):
+        stats.update(case=case, size=size, rows=rows,
+                     rows_per_s=rows / stats['seconds'] if stats['seconds'] else None)
+        results.append(stats)
+        print(f"  {case:<22} {size:>8} {stats['seconds'] * 1000:>10.2f} мс "
+              f"{stats['rows_per_s'] or 0:>14,.0f} строк/с {stats['peak_mb']:>8.2f} MB")
+
+    print(f"\n  {'Тест':<22} {'Размер':>8} {'Время':>13} {'Строк/с':>22} {'Память':>11}")
+    for size in sizes:
+        rows = make_cme_rows(size, seed=size)
+        xlsx_path = workdir / f'cme_{size}.xlsx'
+        xls_path = workdir / f'cme_{size}.xls'
+        write_cme_xlsx(rows, xlsx_path)
+
+        add('scan_option_rows', size, len(rows),
+            measure(lambda: processor._scan_option_rows(iter(rows), OPTION_TYPE), repeat))
+        add('read_cme_xlsx', size, len(rows),
+            measure(lambda: processor._read_cme_xlsx(xlsx_path, OPTION_TYPE), repeat))
+        if write_cme_xls(rows, xls_path):
+            add('read_cme_xls', size, len(rows),
+                measure(lambda: processor._read_cme_xls(xls_path, OPTION_TYPE), repeat))
+        else:
+            print(f"  ⚠️ read_cme_xls {size}: нужен xlwt и не более {XLS_MAX_ROWS} строк, пропущено")
+
+        blocks = processor._scan_option_rows(iter(rows), OPTION_TYPE)
+        call_data, put_data = blocks['call'], blocks['put']
+        strikes = len(call_data['strike']) + len(put_data['strike'])
+        close_price = float(np.median(call_data['strike']))
+
+        add('calculate_metrics', size, strikes,
+            measure(lambda: processor._calculate_metrics(call_data, put_data, close_price, 10000, False), repeat))
+        add('format_strikes', size, strikes,
+            measure(lambda: processor._format_strikes(call_data, put_data, 10000, False), repeat))
+
+    for index, size in enumerate(cftc_sizes):
+        year = 2000 + index
+        zip_path = processor._cftc_zip_path(year)
+        zip_path.parent.mkdir(parents=True, exist_ok=True)
+        if size >= XLS_MAX_ROWS or not write_cftc_zip(size, zip_path, seed=size):
+            print(f"  ⚠️ process_cftc_data {size}: нужен xlwt и менее {XLS_MAX_ROWS} строк, пропущено")
+            continue
+
+        def reset_history():
+            for path in (processor._cftc_history_path(), processor._cftc_sources_path()):
+                if path.exists():
+                    path.unlink()
+
+        add('process_cftc_data', size, size, measure(lambda: processor.process_cftc_data(year), repeat, reset_history))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки обработчика опционных данных на синтетических данных")
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 10000],
+                        help="Число страйков в блоке call/put")
+    parser.add_argument('--cftc-sizes', nargs='+', type=int, default=[1000, 10000, 60000],
+                        help="Число строк в синтетическом отчете CFTC")
+    parser.add_argument('--repeat', type=int, default=3, help="Число повторов (берется лучшее время)")
+    parser.add_argument('--output', type=Path, default=None, help="Файл для результатов в формате JSON lines")
+    args = parser.parse_args()
+
+    # Per-call log lines would dominate the timings
+    logger.setLevel(logging.WARNING)
+    output = args.output.resolve() if args.output else None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        try:
+            results = run(args.sizes, args.cftc_sizes, args.repeat, Path(tmp))
+        finally:
+            os.chdir(cwd)
+
+    if output:
+        with open(output, 'a', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + '\n')
+        print(f"\n💾 Результаты: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import os
 import json
+import argparse
 import datetime
 import logging
 import requests
@@ -8,41 +9,563 @@ import numpy as np
 from pathlib import Path
 from typing import Dict, List, Optional
 import zipfile
+import struct
+import hashlib
+import shutil
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from openpyxl import load_workbook
 import xlrd
 import threading
 import time
 import sys
+import io
+import cProfile
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
+class HistoryStore:
+    """Append-only Parquet store of FOB results partitioned by currency and date.
+
+    Layout: <root>/<kind>/currency=<CUR>/date=<YYYY-MM-DD>/part-0.parquet, where kind is
+    'metrics' (one row of SIP/FOB values per day), 'strikes' (the strike ladder) or 'expiries'
+    (SIP/FOB per expiry in export order, plus the aggregate as expiry 'ALL').
+    """
+
+    SORT_BY = {'metrics': ['date'], 'strikes': ['date', 'side', 'strike'], 'expiries': ['date', 'rank']}
+
+    SIP_FIELDS = ['up_level', 'down_level', 'up_balance_level', 'down_balance_level', 'red_balance_level']
+    FOB_FIELDS = ['opt_in_money_call_i', 'opt_in_money_call_j', 'opt_in_money_put_i', 'opt_in_money_put_j',
+                  'opt_without_money_call_i', 'opt_without_money_call_j',
+                  'opt_without_money_put_i', 'opt_without_money_put_j']
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def write(self, currency: str, report_date: str, close_price: float, result: Dict,
+              call_data: Dict, put_data: Dict) -> bool:
+        """Store one day of results, replacing the partition if the day is re-processed"""
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            logger.warning("⚠️ Модуль pyarrow не установлен, история не сохраняется")
+            return False
+
+        try:
+            metrics = {'close_price': [float(close_price)]}
+            for field in self.SIP_FIELDS:
+                metrics[field] = [float(result['sip'].get(field, np.nan))]
+            for field in self.FOB_FIELDS:
+                metrics[field] = [int(result['fob'].get(field, 0))]
+
+            sides = []
+            for side, data, rows in (('call', call_data, result['strike']['calls']),
+                                     ('put', put_data, result['strike']['puts'])):
+                sides.append(pa.table({
+                    'side': pa.array([side] * len(data['strike']), pa.string()),
+                    'strike': pa.array(np.asarray(data['strike'], dtype=np.int64)),
+                    'price': pa.array(np.array([row['price'] for row in rows], dtype=np.float64)),
+                    'at_close': pa.array(np.asarray(data['at_close'], dtype=np.int64)),
+                    'change': pa.array(np.asarray(data['change'], dtype=np.int64)),
+                }))
+
+            self._write_partition(pq, 'metrics', currency, report_date, pa.table(metrics))
+            self._write_partition(pq, 'strikes', currency, report_date, pa.concat_tables(sides))
+
+            if result.get('expiries'):
+                expiries = list(result['expiries'].items()) + [('ALL', result['aggregate'])]
+                table = {'rank': list(range(len(expiries))), 'expiry': [name for name, _ in expiries],
+                         'open_interest': [values['open_interest'] for _, values in expiries]}
+                for field in self.SIP_FIELDS:
+                    table[field] = [float(values['sip'].get(field, np.nan)) for _, values in expiries]
+                for field in self.FOB_FIELDS:
+                    table[field] = [int(values['fob'].get(field, 0)) for _, values in expiries]
+                self._write_partition(pq, 'expiries', currency, report_date, pa.table(table))
+            return True
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи истории {currency}: {e}")
+            return False
+
+    def _write_partition(self, pq, kind: str, currency: str, report_date: str, table) -> None:
+        """Atomically write a single partition file"""
+        partition = self.root / kind / f"currency={currency}" / f"date={report_date}"
+        partition.mkdir(parents=True, exist_ok=True)
+        tmp_path = partition / "part-0.parquet.tmp"
+        pq.write_table(table, tmp_path)
+        tmp_path.replace(partition / "part-0.parquet")
+
+    def copy(self, currency: str, source_date: str, target_date: str) -> bool:
+        """Store the partitions of one day under another date (input unchanged between them)"""
+        if not (self.root / 'metrics' / f"currency={currency}" / f"date={source_date}").exists():
+            return False
+
+        for kind in self.SORT_BY:
+            source = self.root / kind / f"currency={currency}" / f"date={source_date}" / "part-0.parquet"
+            if not source.exists():
+                continue
+            partition = self.root / kind / f"currency={currency}" / f"date={target_date}"
+            partition.mkdir(parents=True, exist_ok=True)
+            tmp_path = partition / "part-0.parquet.tmp"
+            shutil.copyfile(source, tmp_path)
+            tmp_path.replace(partition / "part-0.parquet")
+        return True
+
+    def load(self, currency: str, kind: str = 'metrics', start: Optional[str] = None,
+             end: Optional[str] = None) -> pd.DataFrame:
+        """Load a currency's time series (or strike ladders) in a single dataset read"""
+        import pyarrow.parquet as pq
+
+        path = self.root / kind / f"currency={currency}"
+        if not path.exists():
+            return pd.DataFrame()
+
+        filters = []
+        if start:
+            filters.append(('date', '>=', start))
+        if end:
+            filters.append(('date', '<=', end))
+
+        table = pq.read_table(path, filters=filters or None, partitioning='hive')
+        df = table.to_pandas()
+        df['date'] = df['date'].astype(str)
+        df.insert(0, 'currency', currency)
+        return df.sort_values(self.SORT_BY[kind], ignore_index=True)
+
+    def dates(self, currency: str) -> List[str]:
+        """List stored dates for a currency"""
+        path = self.root / 'metrics' / f"currency={currency}"
+        if not path.exists():
+            return []
+        return sorted(p.name.split('=', 1)[1] for p in path.glob('date=*'))
+
+    def to_result(self, currency: str, report_date: str) -> Optional[Dict]:
+        """Rebuild the MT5 JSON structure for one day from the store"""
+        metrics = self.load(currency, 'metrics', report_date, report_date)
+        strikes = self.load(currency, 'strikes', report_date, report_date)
+        if metrics.empty:
+            return None
+
+        row = metrics.iloc[0]
+        ladder = {"calls": [], "puts": []}
+        for side, key in (('call', 'calls'), ('put', 'puts')):
+            side_rows = strikes[strikes['side'] == side]
+            ladder[key] = [
+                {"price": float(price), "strike": int(at_close), "delta": int(change)}
+                for price, at_close, change in zip(side_rows['price'], side_rows['at_close'], side_rows['change'])
+            ]
+
+        result = {
+            'strike': ladder,
+            'sip': {field: float(row[field]) for field in self.SIP_FIELDS},
+            'fob': {field: int(row[field]) for field in self.FOB_FIELDS}
+        }
+
+        expiries = self.load(currency, 'expiries', report_date, report_date)
+        if not expiries.empty:
+            by_name = {
+                name: {
+                    'sip': {field: float(values[field]) for field in self.SIP_FIELDS},
+                    'fob': {field: int(values[field]) for field in self.FOB_FIELDS},
+                    'open_interest': int(values['open_interest'])
+                }
+                for name, (_, values) in zip(expiries['expiry'], expiries.iterrows())
+            }
+            aggregate = by_name.pop('ALL')
+            result['expiries'] = by_name
+            result['aggregate'] = aggregate
+        return result
+
+
+class DownloadCache:
+    """Content-addressed cache of CME exports keyed by (productId, tradeDate, reportType).
+
+    Bodies are stored once under objects/<sha256>.xls and index.json maps each key to the
+    content hash, size and fetch time. An entry is fresh for ttl_hours after it was fetched,
+    and permanently once it was fetched settle_days or more after its trade date. Eviction
+    drops entries older than max_age_days, then the oldest ones until the cache fits in max_bytes.
+    """
+
+    def __init__(self, root: Path, ttl_hours: float = 24, settle_days: int = 3,
+                 max_age_days: int = 365, max_bytes: int = 1024 * 1024 * 1024):
+        self.root = root
+        self.objects_path = root / 'objects'
+        self.index_path = root / 'index.json'
+        self.ttl = datetime.timedelta(hours=ttl_hours)
+        self.settle = datetime.timedelta(days=settle_days)
+        self.max_age = datetime.timedelta(days=max_age_days)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.objects_path.mkdir(parents=True, exist_ok=True)
+        self.index = self._load_index()
+
+    def __getstate__(self):
+        # The lock cannot be pickled when the processor is sent to pool workers
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(product_id: str, trade_date: str, report_type: str) -> str:
+        """Index key of an export"""
+        return f"{product_id}:{trade_date}:{report_type}"
+
+    def _load_index(self) -> Dict:
+        """Load the index, starting empty if it is missing or unreadable"""
+        try:
+            return json.loads(self.index_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        """Atomically write the index (caller holds the lock)"""
+        tmp_path = self.index_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.index, indent=2), encoding='utf-8')
+        tmp_path.replace(self.index_path)
+
+    def _object_path(self, sha256: str) -> Path:
+        """Location of a content object"""
+        return self.objects_path / f"{sha256}.xls"
+
+    def is_fresh(self, entry: Dict, trade_date: str, now: Optional[datetime.datetime] = None) -> bool:
+        """Whether a cached entry can be served without a network request"""
+        now = now or datetime.datetime.now()
+        fetched_at = datetime.datetime.fromisoformat(entry['fetched_at'])
+        if fetched_at - datetime.datetime.strptime(trade_date, "%Y%m%d") >= self.settle:
+            return True
+        return now - fetched_at < self.ttl
+
+    def get(self, product_id: str, trade_date: str, report_type: str = 'P') -> Optional[Path]:
+        """Path of a fresh cached export, or None on a miss"""
+        with self._lock:
+            entry = self.index.get(self.key(product_id, trade_date, report_type))
+        if not entry or not self.is_fresh(entry, trade_date):
+            return None
+        path = self._object_path(entry['sha256'])
+        return path if path.exists() else None
+
+    def put(self, product_id: str, trade_date: str, report_type: str, content: bytes) -> Path:
+        """Store an export and return the path of its content object"""
+        sha256 = hashlib.sha256(content).hexdigest()
+        path = self._object_path(sha256)
+        if not path.exists():
+            tmp_path = path.with_suffix('.part')
+            tmp_path.write_bytes(content)
+            tmp_path.replace(path)
+
+        with self._lock:
+            self.index[self.key(product_id, trade_date, report_type)] = {
+                'sha256': sha256,
+                'size': len(content),
+                'fetched_at': datetime.datetime.now().isoformat(timespec='seconds')
+            }
+            self._save_index()
+        return path
+
+    def evict(self) -> int:
+        """Apply the age and size limits; returns the number of removed entries"""
+        with self._lock:
+            now = datetime.datetime.now()
+            entries = sorted(self.index.items(), key=lambda item: item[1]['fetched_at'])
+            keep = [(k, e) for k, e in entries
+                    if now - datetime.datetime.fromisoformat(e['fetched_at']) < self.max_age]
+
+            total = sum(e['size'] for e in {e['sha256']: e for _, e in keep}.values())
+            while keep and total > self.max_bytes:
+                _, oldest = keep.pop(0)
+                if all(e['sha256'] != oldest['sha256'] for _, e in keep):
+                    total -= oldest['size']
+
+            removed = len(entries) - len(keep)
+            self.index = dict(keep)
+            referenced = {e['sha256'] for e in self.index.values()}
+            for path in self.objects_path.glob('*.xls'):
+                if path.stem not in referenced:
+                    path.unlink()
+            if removed:
+                self._save_index()
+            return removed
+
+
+class ChangeTracker:
+    """Fingerprints of the parsed CME input per currency and deltas between processed days.
+
+    <root>/<CUR>.json keeps the state of the latest processed report date: the input hash, the
+    date, the SIP/FOB values and the open interest by strike of the front series. One file per
+    currency lets pool workers update their currencies independently. Days older than the state
+    (a backfill) neither use nor replace it, so daily deltas stay relative to the latest day.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    @staticmethod
+    def fingerprint(series: Dict, close_price: float, info: Dict) -> str:
+        """Hash of every parsed array, the close price and the instrument settings"""
+        digest = hashlib.sha256()
+        digest.update(json.dumps([close_price, info['coefficient'], info['inverted']]).encode())
+        for name, sides in series.items():
+            digest.update(name.encode())
+            for side in ('call', 'put'):
+                for key in ('strike', 'at_close', 'change'):
+                    digest.update(np.ascontiguousarray(sides[side][key], dtype=np.int64).tobytes())
+        return digest.hexdigest()
+
+    def load(self, currency: str) -> Optional[Dict]:
+        """Last processed state of a currency"""
+        try:
+            return json.loads((self.root / f"{currency}.json").read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+
+    def save(self, currency: str, fingerprint: str, report_date: str, metrics: Dict,
+             call_data: Dict, put_data: Dict):
+        """Store the state of a processed day"""
+        self._write(currency, {
+            'hash': fingerprint,
+            'report_date': report_date,
+            'sip': metrics['sip'],
+            'fob': metrics['fob'],
+            'oi': {side: dict(zip(map(str, data['strike'].tolist()), data['at_close'].tolist()))
+                   for side, data in (('call', call_data), ('put', put_data))}
+        })
+
+    def advance(self, currency: str, state: Dict, report_date: str):
+        """Carry an unchanged state over to a new report date"""
+        self._write(currency, dict(state, report_date=report_date))
+
+    def _write(self, currency: str, state: Dict):
+        """Atomically write the state file of a currency"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.root / f"{currency}.tmp"
+        tmp_path.write_text(json.dumps(state, default=lambda obj: obj.item()), encoding='utf-8')
+        tmp_path.replace(self.root / f"{currency}.json")
+
+    @staticmethod
+    def delta(previous: Dict, report_date: str, metrics: Dict, call_data: Dict, put_data: Dict,
+              to_prices) -> Dict:
+        """Strikes whose open interest moved and SIP levels that shifted since the previous state"""
+        delta = {'previous_date': previous['report_date'], 'report_date': report_date, 'sip': {}}
+        for field, current in metrics['sip'].items():
+            before = previous['sip'].get(field)
+            if before != current:
+                delta['sip'][field] = {'previous': before, 'current': current,
+                                       'change': current - before if before is not None else None}
+
+        for side, key, data in (('call', 'calls', call_data), ('put', 'puts', put_data)):
+            before = {int(strike): oi for strike, oi in previous['oi'][side].items()}
+            current = dict(zip(data['strike'].tolist(), data['at_close'].tolist()))
+            moved = sorted(strike for strike in before.keys() | current.keys()
+                           if before.get(strike, 0) != current.get(strike, 0))
+            prices = to_prices(moved).tolist() if moved else []
+            delta[key] = [
+                {'price': price, 'previous': before.get(strike, 0), 'current': current.get(strike, 0),
+                 'change': current.get(strike, 0) - before.get(strike, 0)}
+                for strike, price in zip(moved, prices)
+            ]
+        return delta
+
+
+class PriceSource:
+    """Source of raw daily close prices for a batch of symbols"""
+
+    name = 'base'
+
+    def fetch(self, symbols: List[str], date: Optional[datetime.date] = None) -> Dict[str, tuple]:
+        """Map each available symbol to (bar date YYYY-MM-DD, close); date=None means the last closed bar"""
+        raise NotImplementedError
+
+    def close(self):
+        """Release the connection, if any"""
+
+
+class MT5PriceSource(PriceSource):
+    """MetaTrader 5 terminal; one login serves every batch until close()"""
+
+    name = 'mt5'
+
+    def __init__(self, login: int = 500289067, password: str = '0vC!VxNj',
+                 server: str = 'ForexClub-MT5 Demo Server'):
+        self.login = login
+        self.password = password
+        self.server = server
+        self._mt5 = None
+
+    def __getstate__(self):
+        # The terminal connection belongs to the process that opened it
+        state = self.__dict__.copy()
+        state['_mt5'] = None
+        return state
+
+    def _connect(self):
+        """Initialize and log in once"""
+        if self._mt5 is None:
+            import MetaTrader5 as mt5
+
+            logger.info("🔌 Подключение к MT5...")
+            if not mt5.initialize() or not mt5.login(self.login, self.password, self.server):
+                error = mt5.last_error()
+                mt5.shutdown()
+                raise ConnectionError(f"MT5: {error}")
+            self._mt5 = mt5
+        return self._mt5
+
+    def fetch(self, symbols: List[str], date: Optional[datetime.date] = None) -> Dict[str, tuple]:
+        mt5 = self._connect()
+        prices = {}
+        for symbol in symbols:
+            if date is None:
+                rates = mt5.copy_rates_from_pos(symbol, mt5.TIMEFRAME_D1, 1, 1)
+            else:
+                # The daily bar of `date` is the last one opened before the next day
+                date_to = datetime.datetime(date.year, date.month, date.day) + datetime.timedelta(days=1)
+                rates = mt5.copy_rates_from(symbol, mt5.TIMEFRAME_D1, date_to, 1)
+            if rates is None or len(rates) == 0:
+                logger.warning(f"⚠️ MT5: нет данных {symbol}")
+                continue
+            bar_date = datetime.datetime.fromtimestamp(int(rates[0][0]), datetime.timezone.utc).date().isoformat()
+            prices[symbol] = (bar_date, float(rates[0][1]))
+        return prices
+
+    def close(self):
+        if self._mt5 is not None:
+            self._mt5.shutdown()
+            self._mt5 = None
+
+
+class CSVPriceSource(PriceSource):
+    """CSV file with date (YYYY-MM-DD), symbol and close columns"""
+
+    name = 'csv'
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._prices = None
+
+    def _load(self) -> Dict[str, Dict[str, float]]:
+        """Prices by symbol and date, read once"""
+        if self._prices is None:
+            frame = pd.read_csv(self.path, dtype={'date': str, 'symbol': str})
+            self._prices = {}
+            for date, symbol, close in zip(frame['date'], frame['symbol'], frame['close']):
+                self._prices.setdefault(symbol, {})[date] = float(close)
+        return self._prices
+
+    def fetch(self, symbols: List[str], date: Optional[datetime.date] = None) -> Dict[str, tuple]:
+        prices = {}
+        for symbol in symbols:
+            by_date = self._load().get(symbol, {})
+            key = date.isoformat() if date else max(by_date, default=None)
+            if key in by_date:
+                prices[symbol] = (key, by_date[key])
+        return prices
+
+
+class PriceCache(CSVPriceSource):
+    """On-disk close prices keyed by (symbol, date), stored in the CSVPriceSource format"""
+
+    name = 'cache'
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Dict[str, float]]:
+        if self._prices is None and not self.path.exists():
+            self._prices = {}
+        return super()._load()
+
+    def put(self, prices: Dict[str, tuple]):
+        """Store fetched prices and rewrite the file"""
+        if not prices:
+            return
+        with self._lock:
+            cached = self._load()
+            for symbol, (date, close) in prices.items():
+                cached.setdefault(symbol, {})[date] = close
+
+            rows = [(date, symbol, close) for symbol, by_date in cached.items() for date, close in by_date.items()]
+            frame = pd.DataFrame(sorted(rows), columns=['date', 'symbol', 'close'])
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix('.tmp')
+            frame.to_csv(tmp_path, index=False)
+            tmp_path.replace(self.path)
+
+
+INSTRUMENTS_PATH = Path(__file__).with_name('instruments.json')
+INSTRUMENT_FIELDS = ('id', 'symbol', 'coefficient', 'price_scale', 'inverted', 'option_type')
+
+
+def load_instruments(path: Path) -> Dict[str, Dict]:
+    """Load and validate the instrument registry (currency -> settings) from a JSON file.
+
+    Every CME instrument needs INSTRUMENT_FIELDS; 'cftc_market' optionally names its market in
+    the CFTC report (matched exactly). An entry with only 'cftc_market' is tracked in CFTC alone.
+    """
+    instruments = json.loads(Path(path).read_text(encoding='utf-8'))
+    for currency, info in instruments.items():
+        if set(info) == {'cftc_market'}:
+            continue
+        missing = [field for field in INSTRUMENT_FIELDS if field not in info]
+        if missing:
+            raise ValueError(f"{path}: у {currency} нет полей {', '.join(missing)}")
+        info['id'] = str(info['id'])
+    return instruments
+
+
 class SimpleOptionsProcessor:
     """Simple and reliable options data processor"""
 
-    def __init__(self):
+    # Record of the binary output format: price, open interest at close, change
+    BINARY_RECORD = np.dtype([('price', '<f8'), ('strike', '<i8'), ('delta', '<i8')])
+
+    def __init__(self, output_format: str = 'json', price_sources: Optional[List[PriceSource]] = None,
+                 instruments_path: Optional[Path] = None):
         self.base_path = Path.cwd()
+        self.output_format = output_format
         self.old_version_path = self.base_path / "old version"
         self.new_version_path = self.base_path / "new version"
         self.output_path = self._get_output_path()
+        self.history = HistoryStore(self.base_path / "history")
+        self.cme_cache = DownloadCache(self.base_path / "cache" / "cme")
+        self.price_cache = PriceCache(self.base_path / "cache" / "prices.csv")
+        self.changes = ChangeTracker(self.base_path / "history" / "fingerprints")
+        self.price_sources = price_sources if price_sources is not None else [MT5PriceSource()]
 
         # Setup directories
         self.old_version_path.mkdir(exist_ok=True)
         self.new_version_path.mkdir(exist_ok=True)
         self.output_path.mkdir(parents=True, exist_ok=True)
 
-        # Configuration
-        self.currencies = {
-            'EUR': {'id': '58', 'coefficient': 10000, 'option_type': 'OPTION TYPE: Monthly Options'},
-            'GBP': {'id': '42', 'coefficient': 1000, 'option_type': 'OPTION TYPE: Monthly Options'},
-            'AUD': {'id': '37', 'coefficient': 10000, 'option_type': 'OPTION TYPE: Monthly Options'},
-            'CAD': {'id': '48', 'coefficient': 10000000, 'option_type': 'OPTION TYPE: Monthly Options'},
-            'JPY': {'id': '69', 'coefficient': 1000000, 'option_type': 'OPTION TYPE: Monthly Options'},
-            'XAU': {'id': '437', 'coefficient': 1, 'option_type': 'OPTION TYPE: American Options'},
-            'XAG': {'id': '458', 'coefficient': 100, 'option_type': 'OPTION TYPE: American Options'}
-        }
+        # Instrument registry: CME product, strike coefficient, inversion, price scale, MT5 symbol
+        # and CFTC market; CFTC-only entries are left out of the CME stages
+        registry = load_instruments(instruments_path or INSTRUMENTS_PATH)
+        self.currencies = {currency: info for currency, info in registry.items() if 'id' in info}
+        # CFTC market names of the tracked futures, matched exactly (E-mini and other contracts contain them)
+        self.cftc_markets = {info['cftc_market']: currency for currency, info in registry.items()
+                             if info.get('cftc_market')}
 
         # Create session for downloads
         self.session = requests.Session()
@@ -50,6 +573,12 @@ class SimpleOptionsProcessor:
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         })
 
+        # Per-currency download results of the last CME run
+        self.download_report = {}
+        # Bytes downloaded / rows parsed by the last CFTC run and rows parsed by process_currency
+        self.cftc_report = {'bytes': 0, 'rows': 0}
+        self.parse_report = {'rows': 0, 'metrics': None, 'unchanged': False, 'delta': None}
+
     def _get_output_path(self) -> Path:
         """Get output path for JSON files"""
         try:
@@ -73,199 +602,275 @@ class SimpleOptionsProcessor:
         print(f"📂 JSON результаты: {self.output_path}")
         print("=" * 60)
 
-    def get_trading_date(self, days_back: int = 2) -> str:
+    def get_trading_date(self, days_back: int = 2, now: Optional[datetime.datetime] = None) -> str:
         """Get trading date (skip weekends)"""
-        date = datetime.datetime.now()
+        date = now or datetime.datetime.now()
         while days_back > 0:
             date -= datetime.timedelta(days=1)
             if date.weekday() < 5:  # Skip weekends
                 days_back -= 1
         return date.strftime("%Y%m%d")
 
-    def download_cme_files(self) -> bool:
-        """Download CME options data files"""
-        try:
-            # Check if files already exist
-            existing_files = list(self.old_version_path.glob('*.xls'))
-            if existing_files:
-                logger.info("📁 XLS файлы уже существуют")
-                return True
+    def trade_day(self, trade_date: Optional[str] = None) -> datetime.date:
+        """CME trade date (YYYYMMDD, the current trading date by default) as a date.
 
-            trade_date = self.get_trading_date()
-            url = 'https://www.cmegroup.com/CmeWS/exp/voiProductDetailsViewExport.ctl'
+        Its ISO form keys every output of the day: result files, history partitions,
+        change-tracking state and latest.json, for daily runs and backfills alike.
+        """
+        return datetime.datetime.strptime(trade_date or self.get_trading_date(), "%Y%m%d").date()
 
-            logger.info(f"📥 Загрузка данных CME за {trade_date}")
-
-            for currency, info in self.currencies.items():
-                try:
-                    logger.info(f"⬇️ Загрузка {currency}...")
+    def download_cme_files(self, max_workers: Optional[int] = None, retries: int = 3, backoff: float = 2.0,
+                           trade_date: Optional[str] = None) -> bool:
+        """Download CME options data files concurrently, serving fresh copies from the cache"""
+        try:
+            trade_date = trade_date or self.get_trading_date()
+            self.download_report = self._download_cme_batch(trade_date, self.old_version_path,
+                                                            list(self.currencies), max_workers, retries, backoff)
 
-                    params = {
-                        'media': 'xls',
-                        'tradeDate': trade_date,
-                        'reportType': 'P',
-                        'productId': info['id']
-                    }
+            loaded = [c for c in self.currencies if self.download_report[c]['success']]
+            failed = [c for c in self.currencies if not self.download_report[c]['success']]
 
-                    response = self.session.get(url, params=params, timeout=30)
-                    response.raise_for_status()
+            for currency in self.currencies:
+                report = self.download_report[currency]
+                status = "✅" if report['success'] else "❌"
+                source = "кэш" if report['cached'] else f"попыток {report['attempts']}"
+                logger.info(f"   {status} {currency}: {source}, {report['elapsed']:.1f}с")
 
-                    file_path = self.old_version_path / f'{currency}.xls'
-                    with open(file_path, 'wb') as f:
-                        f.write(response.content)
+            if not loaded:
+                logger.error("❌ Не удалось загрузить ни одного файла CME")
+                return False
 
-                    logger.info(f"✅ {currency} загружен")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка загрузки {currency}: {e}")
-                    return False
+            if failed:
+                logger.warning(f"⚠️ CME загружено {len(loaded)}/{len(self.currencies)}, "
+                               f"ошибки: {', '.join(failed)}")
+            else:
+                logger.info("✅ Все файлы CME загружены")
 
-            logger.info("✅ Все файлы CME загружены")
+            self.cme_cache.evict()
             return True
 
         except Exception as e:
             logger.error(f"❌ Общая ошибка загрузки CME: {e}")
             return False
 
-    def download_cftc_simple(self) -> bool:
-        """Simple CFTC download"""
+    def _download_cme_batch(self, trade_date: str, target_dir: Path, currencies: List[str],
+                            max_workers: Optional[int] = None, retries: int = 3,
+                            backoff: float = 2.0) -> Dict[str, Dict]:
+        """Download CME exports for the given currencies into target_dir on a thread pool"""
+        url = 'https://www.cmegroup.com/CmeWS/exp/voiProductDetailsViewExport.ctl'
+        # Dozens of products are fetched in bounded batches rather than one thread each
+        max_workers = max_workers or min(len(currencies), 8)
+        target_dir.mkdir(parents=True, exist_ok=True)
+
+        logger.info(f"📥 Загрузка данных CME за {trade_date} ({max_workers} потоков)")
+
+        report = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self._download_cme_currency, url, trade_date, currency,
+                                self.currencies[currency]['id'], target_dir / f'{currency}.xls',
+                                retries, backoff): currency
+                for currency in currencies
+            }
+            for future in as_completed(futures):
+                report[futures[future]] = future.result()
+
+        return report
+
+    def _download_cme_currency(self, url: str, trade_date: str, currency: str, product_id: str,
+                               file_path: Path, retries: int, backoff: float) -> Dict:
+        """Fetch one CME export from the cache or the network, retrying with exponential backoff"""
+        params = {
+            'media': 'xls',
+            'tradeDate': trade_date,
+            'reportType': 'P',
+            'productId': product_id
+        }
+        report = {'success': False, 'cached': False, 'attempts': 0, 'elapsed': 0.0, 'bytes': 0, 'error': None}
+        start = time.time()
+
+        cached_path = self.cme_cache.get(product_id, trade_date, params['reportType'])
+        if cached_path:
+            shutil.copyfile(cached_path, file_path)
+            report.update(success=True, cached=True, elapsed=time.time() - start)
+            logger.info(f"📁 {currency} взят из кэша")
+            return report
+
+        for attempt in range(1, retries + 1):
+            report['attempts'] = attempt
+            try:
+                logger.info(f"⬇️ Загрузка {currency} (попытка {attempt})...")
+
+                response = self.session.get(url, params=params, timeout=30)
+                response.raise_for_status()
+                if not response.content:
+                    raise ValueError("пустой ответ")
+
+                cached_path = self.cme_cache.put(product_id, trade_date, params['reportType'], response.content)
+                shutil.copyfile(cached_path, file_path)
+
+                report['success'] = True
+                report['bytes'] = len(response.content)
+                report['error'] = None
+                logger.info(f"✅ {currency} загружен")
+                break
+            except Exception as e:
+                report['error'] = str(e)
+                logger.warning(f"⚠️ Ошибка загрузки {currency} (попытка {attempt}/{retries}): {e}")
+                if attempt < retries:
+                    time.sleep(backoff * 2 ** (attempt - 1))
+
+        report['elapsed'] = time.time() - start
+        if not report['success']:
+            logger.error(f"❌ {currency} не загружен: {report['error']}")
+        return report
+
+    def download_cftc_simple(self, year: Optional[int] = None, chunk_size: int = 1024 * 1024) -> bool:
+        """Download the yearly CFTC archive, skipping it when the server copy is unchanged"""
         try:
-            year = datetime.datetime.now().year
+            year = year or datetime.datetime.now().year
             url = f"https://www.cftc.gov/files/dea/history/fut_fin_xls_{year}.zip"
-            zip_path = f"fut_fin_{year}.zip"
+            zip_path = self._cftc_zip_path(year)
+            meta_path = zip_path.with_suffix('.json')
+            zip_path.parent.mkdir(parents=True, exist_ok=True)
+
+            # Conditional request: the server answers 304 if the archive has not changed
+            headers = {}
+            if zip_path.exists() and meta_path.exists():
+                meta = json.loads(meta_path.read_text(encoding='utf-8'))
+                if meta.get('etag'):
+                    headers['If-None-Match'] = meta['etag']
+                if meta.get('last_modified'):
+                    headers['If-Modified-Since'] = meta['last_modified']
 
             logger.info(f"📥 Загрузка CFTC данных за {year} год...")
 
-            response = self.session.get(url, timeout=300, stream=True)
+            response = self.session.get(url, timeout=300, stream=True, headers=headers)
+            self.cftc_report['bytes'] = 0
+            if response.status_code == 304:
+                response.close()
+                logger.info("✅ CFTC архив не изменился, используется кэш")
+                return True
             response.raise_for_status()
 
             total_size = int(response.headers.get('content-length', 0))
             logger.info(f"📦 Размер файла: {total_size / (1024 * 1024):.1f} MB")
 
             downloaded = 0
-            with open(zip_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
+            next_progress = 25
+            tmp_path = zip_path.with_suffix('.part')
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
                     if chunk:
                         f.write(chunk)
                         downloaded += len(chunk)
 
-                        if total_size > 0:
-                            progress = (downloaded / total_size) * 100
-                            if progress % 25 < 0.8:  # Show every 25%
-                                logger.info(f"📊 {progress:.0f}%")
-
-            # Extract
-            if zipfile.is_zipfile(zip_path):
-                with zipfile.ZipFile(zip_path, 'r') as z:
-                    z.extractall()
-                os.remove(zip_path)
-                logger.info("✅ CFTC данные загружены")
-                return True
-            else:
-                logger.error("❌ Поврежденный файл")
-                return False
-
-        except Exception as e:
-            logger.error(f"❌ Ошибка загрузки CFTC: {e}")
-            return False
+                        if total_size > 0 and downloaded * 100 >= next_progress * total_size:
+                            logger.info(f"📊 {next_progress}%")
+                            next_progress += 25
 
-    def convert_files(self) -> bool:
-        """Convert XLS to XLSX"""
-        try:
-            xls_files = list(self.old_version_path.glob('*.xls'))
-            if not xls_files:
-                logger.warning("⚠️ Нет XLS файлов для конвертации")
+            if not zipfile.is_zipfile(tmp_path):
+                tmp_path.unlink()
+                logger.error("❌ Поврежденный файл")
                 return False
 
-            logger.info(f"🔄 Конвертация {len(xls_files)} файлов...")
-
-            for file_path in xls_files:
-                try:
-                    logger.info(f"🔄 {file_path.name}")
-
-                    # Read XLS
-                    df = pd.read_excel(file_path, engine='xlrd')
-
-                    # Save as XLSX
-                    output_path = self.new_version_path / f"{file_path.stem}.xlsx"
-                    df.to_excel(output_path, index=False, engine='openpyxl')
-
-                    # Remove original
-                    file_path.unlink()
-
-                    logger.info(f"✅ {file_path.name} → {output_path.name}")
+            tmp_path.replace(zip_path)
+            self.cftc_report['bytes'] = downloaded
+            meta_path.write_text(json.dumps({
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'size': downloaded
+            }), encoding='utf-8')
 
-                except Exception as e:
-                    logger.error(f"❌ Ошибка конвертации {file_path.name}: {e}")
-                    continue
-
-            logger.info("✅ Конвертация завершена")
+            logger.info("✅ CFTC данные загружены")
             return True
 
         except Exception as e:
-            logger.error(f"❌ Общая ошибка конвертации: {e}")
+            logger.error(f"❌ Ошибка загрузки CFTC: {e}")
             return False
 
-    def get_close_prices(self) -> Optional[List[float]]:
-        """Get close prices from MT5 using your exact function"""
-        try:
-            import MetaTrader5 as mt5
+    def _cftc_zip_path(self, year: int) -> Path:
+        """Location of the cached yearly CFTC archive"""
+        return self.base_path / 'cache' / 'cftc' / f"fut_fin_xls_{year}.zip"
+
+    def get_close_prices(self, date: Optional[datetime.date] = None) -> Optional[Dict[str, float]]:
+        """Get close prices of the instruments in strike units (for a past date if given).
+
+        A past date is served from the price cache first; missing symbols are fetched in one batch
+        per source, in order, and every fetched price is added to the cache. Instruments without a
+        price are left out of the result (and skipped by processing); None if no price was found.
+        """
+        symbols = [info['symbol'] for info in self.currencies.values()]
+        found = self.price_cache.fetch(symbols, date) if date else {}
+        for source in self.price_sources:
+            missing = [symbol for symbol in symbols if symbol not in found]
+            if not missing:
+                break
+            try:
+                fetched = source.fetch(missing, date)
+            except ImportError as e:
+                logger.error(f"❌ Модуль для источника {source.name} не установлен: {e}")
+                continue
+            except Exception as e:
+                logger.error(f"❌ Ошибка получения цен ({source.name}): {e}")
+                continue
+            if date:
+                # A past day is cached under the requested date even if the bar is older (holidays)
+                fetched = {symbol: (date.isoformat(), close) for symbol, (_, close) in fetched.items()}
+            self.price_cache.put(fetched)
+            found.update(fetched)
+
+        missing = [symbol for symbol in symbols if symbol not in found]
+        if len(missing) == len(symbols):
+            logger.error("❌ Нет цен")
+            return None
+        if missing:
+            logger.warning(f"⚠️ Нет цен, инструменты пропущены: {', '.join(missing)}")
+
+        logger.info("✅ Цены получены:")
+        return self._quotes_to_prices({currency: found[info['symbol']] for currency, info in self.currencies.items()
+                                       if info['symbol'] in found})
+
+    def get_alternative_prices(self) -> Optional[Dict[str, float]]:
+        """Approximate prices: the most recent cached close of every symbol"""
+        found = self.price_cache.fetch([info['symbol'] for info in self.currencies.values()])
+        missing = [info['symbol'] for info in self.currencies.values() if info['symbol'] not in found]
+        if missing:
+            logger.error(f"❌ В кэше нет цен: {', '.join(missing)}")
+            return None
 
-            logger.info("🔌 Подключение к MT5...")
+        logger.info("📊 Примерные цены из кэша:")
+        return self._quotes_to_prices({currency: found[info['symbol']] for currency, info in self.currencies.items()})
 
-            # Your exact working code
-            mt5.initialize()
-            login = 500289067
-            password = '0vC!VxNj'
-            server = 'ForexClub-MT5 Demo Server'
-            mt5.login(login, password, server)
-            symbols = ["EURUSD", "GBPUSD", "AUDUSD", "USDCAD", "USDJPY", "XAUUSD", "XAGUSD"]
-
-            # Get prices
-            closed_price = [mt5.copy_rates_from_pos(i, mt5.TIMEFRAME_D1, 1, 1)[0][1] for i in symbols]
-            mt5.shutdown()
-
-            # Your exact transformations
-            closed_price[0] = round(closed_price[0] * 10000) /10000
-            closed_price[1] = round(closed_price[1] * 1000) /1000
-            closed_price[2] = round(closed_price[2] * 10000) /10000
-            closed_price[3] = round(closed_price[3] * 10000) / 10000
-            closed_price[4] = round(closed_price[4] * 1000000) / 1000000
-            closed_price[5] = round(closed_price[5])
-            closed_price[6] = round(closed_price[6])
-
-            logger.info("✅ Цены получены из MT5:")
-            for symbol, price in zip(symbols, closed_price):
-                logger.info(f"   {symbol}: {price}")
-
-            return closed_price
+    def _quotes_to_prices(self, quotes: Dict[str, tuple]) -> Dict[str, float]:
+        """Convert (date, quote) pairs of each currency to strike units and log them"""
+        prices = {}
+        for currency, (date, quote) in quotes.items():
+            prices[currency] = self.quote_to_price(currency, quote)
+            logger.info(f"   {self.currencies[currency]['symbol']}: {quote} → {prices[currency]} ({date})")
+        return prices
 
-        except ImportError:
-            logger.error("❌ Модуль MetaTrader5 не установлен")
-            return None
-        except Exception as e:
-            logger.error(f"❌ Ошибка получения цен: {e}")
-            return None
+    def quote_to_price(self, currency: str, quote: float) -> int:
+        """Express an MT5 quote in the strike units of the CME product"""
+        info = self.currencies[currency]
+        return round((1 / quote if info['inverted'] else quote) * info['price_scale'])
 
-    def get_manual_prices(self) -> Optional[List[float]]:
+    def close_price_sources(self):
+        """Close the connections of the price sources"""
+        for source in self.price_sources:
+            source.close()
+
+    def get_manual_prices(self) -> Optional[Dict[str, float]]:
         """Get prices through manual input"""
         try:
             print("\n" + "=" * 50)
             print("✏️  РУЧНОЙ ВВОД ЦЕН")
             print("=" * 50)
 
-            defaults = [
-                ("EURUSD", "1.0850"),
-                ("GBPUSD", "1.2650"),
-                ("AUDUSD", "0.6750"),
-                ("USDCAD", "1.3650"),
-                ("USDJPY", "148.50"),
-                ("XAUUSD", "2050.00"),
-                ("XAGUSD", "24.50")
-            ]
-
-            raw_prices = []
+            prices = {}
 
-            for symbol, default in defaults:
+            for currency, info in self.currencies.items():
+                symbol, default = info['symbol'], info.get('default_quote')
                 while True:
                     try:
                         user_input = input(f"📈 {symbol} (по умолчанию {default}): ").strip()
@@ -275,27 +880,16 @@ class SimpleOptionsProcessor:
                             print("   ❌ Цена должна быть больше нуля")
                             continue
 
-                        raw_prices.append(price)
+                        prices[currency] = self.quote_to_price(currency, price)
                         print(f"   ✅ {symbol}: {price}")
                         break
 
-                    except ValueError:
+                    except (ValueError, TypeError):
                         print("   ❌ Введите корректное число")
                         continue
 
-            # Transform prices
-            transformed = [
-                round(raw_prices[0] * 10000),  # EURUSD
-                round(raw_prices[1] * 1000),  # GBPUSD
-                round(raw_prices[2] * 10000),  # AUDUSD
-                round(1 / raw_prices[3] * 10000),  # USDCAD
-                round(1 / raw_prices[4] * 1000000),  # USDJPY
-                round(raw_prices[5]),  # XAUUSD
-                round(raw_prices[6] * 100)  # XAGUSD
-            ]
-
             logger.info("✅ Цены введены вручную")
-            return transformed
+            return prices
 
         except KeyboardInterrupt:
             logger.info("🛑 Ввод отменен")
@@ -304,53 +898,89 @@ class SimpleOptionsProcessor:
             logger.error(f"❌ Ошибка ввода: {e}")
             return None
 
-    def process_currency(self, currency: str, close_price: float) -> bool:
-        """Process options data for currency"""
+    def process_currency(self, currency: str, close_price: float, data_dir: Optional[Path] = None,
+                         report_date: Optional[str] = None, use_xlsx: bool = False) -> bool:
+        """Process options data for currency.
+
+        Converted XLSX files in 'new version' are read only when use_xlsx is set: they are not
+        refreshed by downloads and would otherwise be published as the current day.
+        """
+        self.parse_report = {'rows': 0, 'metrics': None, 'unchanged': False, 'delta': None}
         try:
             currency_info = self.currencies[currency]
+            xls_path = (data_dir or self.old_version_path) / f"{currency}.xls"
             file_path = self.new_version_path / f"{currency}.xlsx"
 
-            if not file_path.exists():
-                logger.error(f"❌ Файл не найден: {file_path}")
+            if not xls_path.exists() and not (use_xlsx and file_path.exists()):
+                logger.error(f"❌ Файл не найден: {xls_path}")
                 return False
 
             logger.info(f"📊 Обработка {currency}...")
 
-            # Load workbook
-            wb = load_workbook(str(file_path))
-            ws = wb.active
-
-            # Find data ranges
             option_type = currency_info['option_type']
-            ranges = self._find_ranges(ws, option_type)
+            if xls_path.exists():
+                # Read the original CME export directly, no XLSX round-trip
+                blocks = self._read_cme_xls(xls_path, option_type)
+            else:
+                # Previously converted XLSX files are streamed in read-only mode
+                blocks = self._read_cme_xlsx(file_path, option_type)
 
-            if not ranges:
+            if not blocks:
                 logger.error(f"❌ Не найдены диапазоны для {currency}")
                 return False
 
-            # Extract data
-            call_data = self._extract_data(ws, ranges['call'])
-            put_data = self._extract_data(ws, ranges['put'])
+            call_data = blocks['call']
+            put_data = blocks['put']
+            self.parse_report['rows'] = sum(len(sides['call']['strike']) + len(sides['put']['strike'])
+                                            for sides in blocks['series'].values())
 
-            if not call_data['strike'] or not put_data['strike']:
+            if len(call_data['strike']) == 0 or len(put_data['strike']) == 0:
                 logger.error(f"❌ Нет данных для {currency}")
                 return False
 
+            # Skip recomputation when the parsed input is identical to the last processed one
+            report_date = report_date or self.trade_day().isoformat()
+            fingerprint = self.changes.fingerprint(blocks['series'], close_price, currency_info)
+            latest = self.changes.load(currency)
+            previous = latest if latest and latest['report_date'] <= report_date else None
+            if previous and previous['hash'] == fingerprint and self._reuse_result(currency, previous, report_date):
+                self.parse_report['metrics'] = {'sip': previous['sip'], 'fob': previous['fob']}
+                self.parse_report['unchanged'] = True
+                return True
+
             # Calculate metrics
             coefficient = currency_info['coefficient']
-            sip_metrics = self._calculate_sip(call_data, put_data, close_price, coefficient, currency)
-            fob_metrics = self._calculate_fob(call_data, put_data, close_price)
-            strike_data = self._format_strikes(call_data, put_data, coefficient, currency)
+            metrics = self._calculate_metrics(call_data, put_data, close_price, coefficient,
+                                              currency_info['inverted'])
+            strike_data = self._format_strikes(call_data, put_data, coefficient, currency_info['inverted'])
+            self.parse_report['metrics'] = metrics
+
+            expiries, aggregate = self._calculate_expiries(blocks['series'], close_price, coefficient,
+                                                           currency_info['inverted'])
 
             # Create result
             result = {
                 'strike': strike_data,
-                'sip': sip_metrics,
-                'fob': fob_metrics
+                'sip': metrics['sip'],
+                'fob': metrics['fob'],
+                'expiries': expiries,
+                'aggregate': aggregate
             }
 
-            # Save JSON
-            self._save_json(result, currency)
+            # Store history and save the result for MT5
+            self.history.write(currency, report_date, close_price, result, call_data, put_data)
+            self._save_result(result, currency, report_date)
+
+            # A re-processed day has no earlier state to compare with; an older (backfilled) day
+            # leaves the state of the latest day in place
+            if previous and previous['report_date'] < report_date:
+                delta = self.changes.delta(
+                    previous, report_date, metrics, call_data, put_data,
+                    lambda strikes: self._strike_prices(strikes, coefficient, currency_info['inverted']))
+                self.parse_report['delta'] = delta
+                self._save_delta(delta, currency, report_date)
+            if not latest or latest['report_date'] <= report_date:
+                self.changes.save(currency, fingerprint, report_date, metrics, call_data, put_data)
 
             logger.info(f"✅ {currency} обработан")
             return True
@@ -359,136 +989,295 @@ class SimpleOptionsProcessor:
             logger.error(f"❌ Ошибка обработки {currency}: {e}")
             return False
 
-    def _find_ranges(self, ws, option_type: str) -> Optional[Dict]:
-        """Find data ranges in worksheet"""
-        try:
-            ranges = {'call': {}, 'put': {}}
-            call_found = False
+    def _reuse_result(self, currency: str, previous: Dict, report_date: str) -> bool:
+        """Keep the result of unchanged input; a new report date gets a copy of the previous file
+        and of its history partitions, so the series has no gaps"""
+        source = self.output_path / self._result_filename(currency, previous['report_date'])
+        if not source.exists():
+            return False
 
-            for row in ws.iter_rows():
-                for cell in row:
-                    if not cell.value:
-                        continue
+        target = self.output_path / self._result_filename(currency, report_date)
+        if target != source:
+            # Without the previous partitions (e.g. history was cleared) the day is recomputed
+            if not self.history.copy(currency, previous['report_date'], report_date):
+                return False
+            shutil.copyfile(source, target)
+            self.changes.advance(currency, previous, report_date)
+            logger.info(f"♻️ {currency}: данные не изменились с {previous['report_date']}, результат скопирован")
+        else:
+            logger.info(f"♻️ {currency}: данные не изменились, пересчет пропущен")
+        return True
 
-                    cell_value = str(cell.value).strip()
-
-                    if cell_value == option_type and not call_found:
-                        ranges['call']['start'] = cell.row + 3
-                        call_found = True
-                    elif call_found and cell_value == 'TOTALS' and 'stop' not in ranges['call']:
-                        ranges['call']['stop'] = cell.row - 1
-                    elif 'stop' in ranges['call'] and cell_value == 'Strike' and 'start' not in ranges['put']:
-                        ranges['put']['start'] = cell.row + 1
-                    elif 'start' in ranges['put'] and cell_value == 'TOTALS':
-                        ranges['put']['stop'] = cell.row - 1
-                        break
+    def _save_delta(self, delta: Dict, currency: str, report_date: str):
+        """Save the compact delta against the previous processed day"""
+        filename = f"DELTA_{currency}_{report_date}.json"
+        try:
+            with open(self.output_path / filename, 'w', encoding='utf-8') as f:
+                json.dump(delta, f, ensure_ascii=False, separators=(',', ':'), default=lambda obj: obj.item())
+            moved = len(delta['calls']) + len(delta['puts'])
+            logger.info(f"🔀 {currency}: изменено страйков {moved}, уровней SIP {len(delta['sip'])} → {filename}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения изменений {currency}: {e}")
+
+    def process_currencies(self, prices: Dict[str, float], workers: Optional[int] = None,
+                           use_xlsx: bool = False, report_date: Optional[str] = None) -> Dict[str, Dict]:
+        """Process every currency that has a price in a process pool and collect per-currency results.
+
+        After a CME download only the currencies downloaded successfully are processed.
+        """
+        currencies = [currency for currency in self.currencies if currency in prices]
+        if self.download_report and not use_xlsx:
+            failed = [c for c in currencies if not self.download_report.get(c, {}).get('success')]
+            if failed:
+                logger.warning(f"⚠️ Пропуск валют без загруженных данных CME: {', '.join(failed)}")
+            currencies = [c for c in currencies if c not in failed]
+        if not currencies:
+            return {}
+        workers = min(workers or os.cpu_count() or 1, len(currencies))
+        results = {}
 
-            # Validate ranges
-            if (ranges['call'].get('start') and ranges['call'].get('stop') and
-                    ranges['put'].get('start') and ranges['put'].get('stop')):
-                return ranges
+        if workers <= 1:
+            for currency in currencies:
+                results[currency] = self._timed_process_currency(currency, prices[currency], use_xlsx, report_date)
+        else:
+            logger.info(f"⚙️ Обработка {len(currencies)} валют в {workers} процессах")
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(self._timed_process_currency, currency, prices[currency], use_xlsx,
+                                    report_date): currency
+                    for currency in currencies
+                }
+                for future in as_completed(futures):
+                    currency = futures[future]
+                    try:
+                        results[currency] = future.result()
+                    except Exception as e:
+                        logger.error(f"❌ Ошибка процесса {currency}: {e}")
+                        results[currency] = {'success': False, 'elapsed': 0.0, 'cpu': 0.0, 'rows': 0,
+                                             'metrics': None, 'unchanged': False, 'process_peak_rss_mb': None,
+                                             'peak_rss_growth_mb': None, 'error': str(e)}
+
+        for currency in currencies:
+            result = results[currency]
+            status = ("♻️" if result['unchanged'] else "✅") if result['success'] else "❌"
+            logger.info(f"   {status} {currency}: {result['elapsed']:.2f}с")
+
+        return results
+
+    def _timed_process_currency(self, currency: str, close_price: float, use_xlsx: bool = False,
+                                report_date: Optional[str] = None) -> Dict:
+        """Run process_currency and measure its wall time, CPU time and rows parsed"""
+        rss_start = process_peak_rss_mb()
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        success = self.process_currency(currency, close_price, report_date=report_date, use_xlsx=use_xlsx)
+        rss_end = process_peak_rss_mb()
+        return {
+            'success': success,
+            'elapsed': time.perf_counter() - start,
+            'cpu': time.process_time() - cpu_start,
+            'rows': self.parse_report['rows'],
+            'metrics': self.parse_report['metrics'],
+            'unchanged': self.parse_report['unchanged'],
+            # A pool worker keeps its peak across currencies: only the growth belongs to this one
+            'process_peak_rss_mb': rss_end,
+            'peak_rss_growth_mb': rss_growth(rss_start, rss_end),
+            'error': None
+        }
 
-            return None
+    def _read_cme_xls(self, file_path: Path, option_type: str) -> Optional[Dict]:
+        """Read call/put blocks straight from the original CME XLS export"""
+        try:
+            workbook = xlrd.open_workbook(str(file_path), on_demand=True)
+            try:
+                sheet = workbook.sheet_by_index(0)
+                rows = (sheet.row_values(row_idx, 0, 10) for row_idx in range(sheet.nrows))
+                return self._scan_option_rows(rows, option_type)
+            finally:
+                workbook.release_resources()
 
         except Exception as e:
-            logger.error(f"Ошибка поиска диапазонов: {e}")
+            logger.error(f"Ошибка чтения {file_path.name}: {e}")
             return None
 
-    def _extract_data(self, ws, range_info: Dict) -> Dict:
-        """Extract data from range"""
-        data = {'strike': [], 'at_close': [], 'change': []}
-
+    def _read_cme_xlsx(self, file_path: Path, option_type: str) -> Optional[Dict]:
+        """Stream call/put blocks from a converted XLSX workbook in read-only mode"""
         try:
-            start_row = range_info.get('start')
-            stop_row = range_info.get('stop')
+            wb = load_workbook(str(file_path), read_only=True, data_only=True)
+            try:
+                rows = wb.active.iter_rows(max_col=10, values_only=True)
+                return self._scan_option_rows(rows, option_type)
+            finally:
+                wb.close()
 
-            if not start_row or not stop_row:
-                return data
+        except Exception as e:
+            logger.error(f"Ошибка чтения {file_path.name}: {e}")
+            return None
 
-            for row in range(start_row, stop_row + 1):
-                try:
-                    strike_val = ws[f'A{row}'].value
-                    at_close_val = ws[f'I{row}'].value
-                    change_val = ws[f'J{row}'].value
+    def _scan_option_rows(self, rows, option_type: str) -> Optional[Dict]:
+        """Index every call/put series block and extract strike/at_close/change in a single pass.
 
-                    if strike_val is None or at_close_val is None or change_val is None:
-                        continue
+        An 'OPTION TYPE: ...' header opens a section, a '<MON YY> Calls' / '<MON YY> Puts' label
+        names the next block, its Strike header opens the data rows and TOTALS closes them.
+        'call'/'put' hold the first series of option_type (the front expiry, as before) and
+        'series' maps every expiry in the export, e.g. 'Monthly Options JUL 25', to its blocks.
+        """
+        columns = {}
+        section = None
+        block = None
+        state = 'search'
 
-                    # Clean and convert values
-                    strike_clean = str(strike_val).replace(",", "").replace("'", "")
-                    at_close_clean = str(at_close_val).replace(",", "")
-                    change_clean = str(change_val).replace(",", "")
+        for row in rows:
+            if not row:
+                continue
 
-                    data['strike'].append(int(float(strike_clean)))
-                    data['at_close'].append(int(float(at_close_clean)))
-                    data['change'].append(int(float(change_clean)))
+            marker = str(row[0]).strip() if row[0] is not None else ''
 
-                except (ValueError, TypeError, AttributeError):
-                    continue
+            if state == 'data':
+                if marker == 'TOTALS':
+                    state = 'search'
+                else:
+                    self._append_option_row(block, row)
+            elif marker.startswith('OPTION TYPE:'):
+                section = marker
+                state = 'search'
+            elif state == 'label':
+                if marker == 'Strike':
+                    state = 'data'
+            elif section is not None:
+                for suffix, side in ((' Calls', 'call'), (' Puts', 'put')):
+                    if marker.endswith(suffix):
+                        sides = columns.setdefault((section, marker[:-len(suffix)]), {
+                            s: {'strike': [], 'at_close': [], 'change': []} for s in ('call', 'put')
+                        })
+                        block = sides[side]
+                        state = 'label'
+                        break
 
-        except Exception as e:
-            logger.error(f"Ошибка извлечения данных: {e}")
+        front = next((key for key in columns if key[0] == option_type), None)
+        if front is None:
+            return None
 
-        return data
+        series = {}
+        for (section, expiry), sides in columns.items():
+            name = f"{section[len('OPTION TYPE:'):].strip()} {expiry}"
+            series[name] = {
+                side: {key: np.array(values, dtype=np.int64) for key, values in data.items()}
+                for side, data in sides.items()
+            }
 
-    def _calculate_sip(self, call_data: Dict, put_data: Dict, close_price: float,
-                       coefficient: float, currency: str) -> Dict:
-        """Calculate SIP metrics"""
+        front_name = f"{option_type[len('OPTION TYPE:'):].strip()} {front[1]}"
+        return {'call': series[front_name]['call'], 'put': series[front_name]['put'], 'series': series}
+
+    def _calculate_expiries(self, series: Dict, close_price: float, coefficient: float,
+                            inverted: bool) -> tuple:
+        """SIP/FOB per expiry and across all expiries.
+
+        The aggregate applies _calculate_metrics, the formula of the front series, to the call and
+        put strikes of every expiry pooled together. Each SIP level therefore averages the strikes
+        of the relevant subset (all calls, puts above the close, ...) by their open interest across
+        expiries; it is not an average of the per-expiry levels, which may be NaN for an expiry
+        without open interest on one side. The FOB counters and open interest are the per-expiry sums.
+        """
+        expiries = {}
+        pooled = {side: {key: [] for key in ('strike', 'at_close', 'change')} for side in ('call', 'put')}
+
+        for name, sides in series.items():
+            if len(sides['call']['strike']) == 0 or len(sides['put']['strike']) == 0:
+                continue
+            metrics = self._calculate_metrics(sides['call'], sides['put'], close_price, coefficient, inverted)
+            metrics['open_interest'] = int(sides['call']['at_close'].sum() + sides['put']['at_close'].sum())
+            expiries[name] = metrics
+            for side in ('call', 'put'):
+                for key in ('strike', 'at_close', 'change'):
+                    pooled[side][key].append(sides[side][key])
+
+        if not expiries:
+            return expiries, {'sip': {}, 'fob': {}, 'open_interest': 0}
+
+        pooled = {side: {key: np.concatenate(arrays) for key, arrays in data.items()}
+                  for side, data in pooled.items()}
+        aggregate = self._calculate_metrics(pooled['call'], pooled['put'], close_price, coefficient, inverted)
+        aggregate['open_interest'] = sum(metrics['open_interest'] for metrics in expiries.values())
+        return expiries, aggregate
+
+    @staticmethod
+    def _append_option_row(data: Dict, row) -> None:
+        """Append strike (A), at close (I) and change (J) of a row, skipping unparsable rows"""
         try:
-            call_df = pd.DataFrame(call_data)
-            put_df = pd.DataFrame(put_data)
-
-            if call_df.empty or put_df.empty:
-                return {}
-
-            call_less = call_df[call_df['strike'] < close_price]
-            put_more = put_df[put_df['strike'] > close_price]
-
-            if currency in ["EUR", "GBP", "AUD", "XAU", "XAG"]:
-                # Direct calculation
-                up_level = (call_df['strike'] * call_df['at_close']).sum() / call_df['at_close'].sum() / coefficient
-                down_level = (put_df['strike'] * put_df['at_close']).sum() / put_df['at_close'].sum() / coefficient
-
-                up_balance = 0
-                if len(put_more) > 0:
-                    up_balance = (put_more['strike'] * put_more['at_close']).sum() / put_more[
-                        'at_close'].sum() / coefficient
-
-                down_balance = 0
-                if len(call_less) > 0:
-                    down_balance = (call_less['strike'] * call_less['at_close']).sum() / call_less[
-                        'at_close'].sum() / coefficient
-
-                red_balance = 0
-                combined_volume = call_less['at_close'].sum() + put_more['at_close'].sum()
-                if combined_volume > 0:
-                    red_balance = ((call_less['strike'] * call_less['at_close']).sum() +
-                                   (put_more['strike'] * put_more['at_close']).sum()) / combined_volume / coefficient
-            else:
-                # Inverted calculation for CAD, JPY
-                up_level = (1 / (
-                            (put_df['strike'] * put_df['at_close']).sum() / put_df['at_close'].sum())) * coefficient
-                down_level = (1 / (
-                            (call_df['strike'] * call_df['at_close']).sum() / call_df['at_close'].sum())) * coefficient
-
-                up_balance = 0
-                if len(call_less) > 0:
-                    up_balance = (1 / ((call_less['strike'] * call_less['at_close']).sum() / call_less[
-                        'at_close'].sum())) * coefficient
-
-                down_balance = 0
-                if len(put_more) > 0:
-                    down_balance = (1 / ((put_more['strike'] * put_more['at_close']).sum() / put_more[
-                        'at_close'].sum())) * coefficient
-
-                red_balance = 0
-                combined_volume = call_less['at_close'].sum() + put_more['at_close'].sum()
-                if combined_volume > 0:
-                    combined_weighted = ((call_less['strike'] * call_less['at_close']).sum() +
-                                         (put_more['strike'] * put_more['at_close']).sum()) / combined_volume
-                    red_balance = (1 / combined_weighted) * coefficient
-
-            return {
+            strike = int(float(str(row[0]).replace(",", "").replace("'", "")))
+            at_close = int(float(str(row[8]).replace(",", "")))
+            change = int(float(str(row[9]).replace(",", "")))
+        except (ValueError, TypeError, IndexError):
+            return
+
+        data['strike'].append(strike)
+        data['at_close'].append(at_close)
+        data['change'].append(change)
+
+    def _calculate_metrics(self, call_data: Dict, put_data: Dict, close_price: float,
+                           coefficient: float, inverted: bool) -> Dict:
+        """Calculate SIP and FOB metrics in one pass over the strike arrays.
+
+        Direct instruments (EUR, GBP, AUD, XAU, XAG) quote strikes as price * coefficient.
+        Inverted instruments (CAD, JPY) quote the reciprocal, so levels are 1 / mean * coefficient.
+        """
+        try:
+            call_strike = np.ascontiguousarray(call_data['strike'], dtype=np.int64)
+            call_oi = np.ascontiguousarray(call_data['at_close'], dtype=np.int64)
+            call_change = np.ascontiguousarray(call_data['change'], dtype=np.int64)
+            put_strike = np.ascontiguousarray(put_data['strike'], dtype=np.int64)
+            put_oi = np.ascontiguousarray(put_data['at_close'], dtype=np.int64)
+            put_change = np.ascontiguousarray(put_data['change'], dtype=np.int64)
+
+            if call_strike.size == 0 or put_strike.size == 0:
+                return {'sip': {}, 'fob': {}}
+
+            # Masks and weighted open interest are computed once and shared by every metric
+            call_less = call_strike < close_price
+            call_more = call_strike > close_price
+            put_more = put_strike > close_price
+            put_less = put_strike < close_price
+
+            call_weighted = call_strike * call_oi
+            put_weighted = put_strike * put_oi
+
+            call_oi_sum = call_oi.sum()
+            put_oi_sum = put_oi.sum()
+            call_weighted_sum = call_weighted.sum()
+            put_weighted_sum = put_weighted.sum()
+
+            call_less_oi = call_oi[call_less].sum()
+            call_less_weighted = call_weighted[call_less].sum()
+            put_more_oi = put_oi[put_more].sum()
+            put_more_weighted = put_weighted[put_more].sum()
+
+            combined_volume = call_less_oi + put_more_oi
+            has_call_less = call_less.any()
+            has_put_more = put_more.any()
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                call_mean = call_weighted_sum / call_oi_sum
+                put_mean = put_weighted_sum / put_oi_sum
+                call_less_mean = call_less_weighted / call_less_oi if has_call_less else None
+                put_more_mean = put_more_weighted / put_more_oi if has_put_more else None
+                red_mean = ((call_less_weighted + put_more_weighted) / combined_volume
+                            if combined_volume > 0 else None)
+
+                if not inverted:
+                    up_level = call_mean / coefficient
+                    down_level = put_mean / coefficient
+                    up_balance = put_more_mean / coefficient if put_more_mean is not None else 0
+                    down_balance = call_less_mean / coefficient if call_less_mean is not None else 0
+                    red_balance = red_mean / coefficient if red_mean is not None else 0
+                else:
+                    up_level = (1 / put_mean) * coefficient
+                    down_level = (1 / call_mean) * coefficient
+                    up_balance = (1 / call_less_mean) * coefficient if call_less_mean is not None else 0
+                    down_balance = (1 / put_more_mean) * coefficient if put_more_mean is not None else 0
+                    red_balance = (1 / red_mean) * coefficient if red_mean is not None else 0
+
+            sip = {
                 'up_level': float(up_level),
                 'down_level': float(down_level),
                 'up_balance_level': float(up_balance),
@@ -496,197 +1285,328 @@ class SimpleOptionsProcessor:
                 'red_balance_level': float(red_balance)
             }
 
-        except Exception as e:
-            logger.error(f"Ошибка расчета SIP: {e}")
-            return {}
-
-    def _calculate_fob(self, call_data: Dict, put_data: Dict, close_price: float) -> Dict:
-        """Calculate FOB metrics"""
-        try:
-            call_df = pd.DataFrame(call_data)
-            put_df = pd.DataFrame(put_data)
-
-            if call_df.empty or put_df.empty:
-                return {}
-
-            call_less = call_df[call_df['strike'] < close_price]
-            put_more = put_df[put_df['strike'] > close_price]
-            call_more = call_df[call_df['strike'] > close_price]
-            put_less = put_df[put_df['strike'] < close_price]
-
-            return {
-                'opt_in_money_call_i': int(call_less['at_close'].sum()),
-                'opt_in_money_call_j': int(call_less['change'].sum()),
-                'opt_in_money_put_i': int(put_more['at_close'].sum()),
-                'opt_in_money_put_j': int(put_more['change'].sum()),
-                'opt_without_money_call_i': int(call_more['at_close'].sum()),
-                'opt_without_money_call_j': int(call_more['change'].sum()),
-                'opt_without_money_put_i': int(put_less['at_close'].sum()),
-                'opt_without_money_put_j': int(put_less['change'].sum())
+            fob = {
+                'opt_in_money_call_i': int(call_less_oi),
+                'opt_in_money_call_j': int(call_change[call_less].sum()),
+                'opt_in_money_put_i': int(put_more_oi),
+                'opt_in_money_put_j': int(put_change[put_more].sum()),
+                'opt_without_money_call_i': int(call_oi[call_more].sum()),
+                'opt_without_money_call_j': int(call_change[call_more].sum()),
+                'opt_without_money_put_i': int(put_oi[put_less].sum()),
+                'opt_without_money_put_j': int(put_change[put_less].sum())
             }
 
-        except Exception as e:
-            logger.error(f"Ошибка расчета FOB: {e}")
-            return {}
+            return {'sip': sip, 'fob': fob}
 
-    def _format_strikes(self, call_data: Dict, put_data: Dict, coefficient: float, currency: str) -> Dict:
+        except Exception as e:
+            logger.error(f"Ошибка расчета метрик: {e}")
+            return {'sip': {}, 'fob': {}}
+
+    @staticmethod
+    def _strike_prices(strikes, coefficient: float, inverted: bool) -> np.ndarray:
+        """Convert CME strikes to prices in one array operation"""
+        strikes = np.asarray(strikes, dtype=np.int64)
+        if inverted:
+            return (1 / strikes) * coefficient
+        return strikes / coefficient
+
+    def _format_strikes(self, call_data: Dict, put_data: Dict, coefficient: float, inverted: bool) -> Dict:
         """Format strike data"""
         try:
-            result = {"calls": [], "puts": []}
-
-            max_len = max(len(call_data['strike']), len(put_data['strike']))
-
-            for i in range(max_len):
-                if i < len(call_data['strike']):
-                    if currency in ["EUR", "GBP", "AUD", "XAU", "XAG"]:
-                        price = call_data['strike'][i] / coefficient
-                    else:
-                        price = (1 / call_data['strike'][i]) * coefficient
-
-                    result["calls"].append({
-                        "price": float(price),
-                        "strike": call_data['at_close'][i],
-                        "delta": call_data['change'][i]
-                    })
-
-                if i < len(put_data['strike']):
-                    if currency in ["EUR", "GBP", "AUD", "XAU", "XAG"]:
-                        price = put_data['strike'][i] / coefficient
-                    else:
-                        price = (1 / put_data['strike'][i]) * coefficient
-
-                    result["puts"].append({
-                        "price": float(price),
-                        "strike": put_data['at_close'][i],
-                        "delta": put_data['change'][i]
-                    })
-
+            result = {}
+            for key, data in (("calls", call_data), ("puts", put_data)):
+                prices = self._strike_prices(data['strike'], coefficient, inverted)
+                at_close = np.asarray(data['at_close'], dtype=np.int64)
+                change = np.asarray(data['change'], dtype=np.int64)
+                result[key] = [
+                    {"price": price, "strike": oi, "delta": delta}
+                    for price, oi, delta in zip(prices.tolist(), at_close.tolist(), change.tolist())
+                ]
             return result
 
         except Exception as e:
             logger.error(f"Ошибка форматирования страйков: {e}")
             return {"calls": [], "puts": []}
 
-    def _save_json(self, data: Dict, currency: str):
-        """Save data to JSON file"""
+    def _save_result(self, result: Dict, currency: str, report_date: Optional[str] = None):
+        """Save a result in the configured output format"""
+        if self.output_format == 'bin':
+            self._save_binary(result, currency, report_date)
+        else:
+            self._save_json(result, currency, report_date)
+
+    def _save_json(self, data: Dict, currency: str, report_date: Optional[str] = None):
+        """Save data to JSON file (indented, or minified when output_format is 'min')"""
         try:
-            filename = f"FOB_{currency}_{datetime.date.today().isoformat()}.json"
+            filename = self._result_filename(currency, report_date, 'json')
             output_path = self.output_path / filename
 
-            # Convert numpy types to native Python types
-            def convert_types(obj):
-                if isinstance(obj, (np.int64, np.int32)):
-                    return int(obj)
-                elif isinstance(obj, (np.float64, np.float32)):
-                    return float(obj)
-                elif isinstance(obj, dict):
-                    return {key: convert_types(value) for key, value in obj.items()}
-                elif isinstance(obj, list):
-                    return [convert_types(item) for item in obj]
-                else:
-                    return obj
-
-            clean_data = convert_types(data)
+            if self.output_format == 'min':
+                options = {'separators': (',', ':')}
+            else:
+                options = {'indent': 2}
 
             with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(clean_data, f, indent=2, ensure_ascii=False)
+                # Results hold native types; default only catches stray NumPy scalars
+                json.dump(data, f, ensure_ascii=False, default=lambda obj: obj.item(), **options)
 
             logger.info(f"💾 {currency} → {filename}")
 
         except Exception as e:
             logger.error(f"❌ Ошибка сохранения {currency}: {e}")
 
-    def process_cftc_data(self) -> bool:
-        """Process CFTC data"""
+    def _save_binary(self, data: Dict, currency: str, report_date: Optional[str] = None):
+        """Save data as a fixed-layout little-endian binary file for MT5.
+
+        Layout: header (char[4] 'FOB1', ushort version, ushort reserved, uint calls, uint puts),
+        then calls and puts as records (double price, long strike, long delta),
+        then 5 SIP doubles and 8 FOB longs in the order of HistoryStore.SIP_FIELDS/FOB_FIELDS.
+        """
         try:
-            cftc_files = list(Path.cwd().glob("FinFut*.xls"))
-            if not cftc_files:
-                logger.warning("⚠️ CFTC файл не найден")
-                return False
+            filename = self._result_filename(currency, report_date, 'bin')
+            output_path = self.output_path / filename
 
-            cftc_file = cftc_files[0]
-            logger.info(f"📊 Обработка CFTC: {cftc_file.name}")
+            ladders = []
+            for key in ("calls", "puts"):
+                rows = data['strike'][key]
+                ladder = np.empty(len(rows), dtype=self.BINARY_RECORD)
+                ladder['price'] = [row['price'] for row in rows]
+                ladder['strike'] = [row['strike'] for row in rows]
+                ladder['delta'] = [row['delta'] for row in rows]
+                ladders.append(ladder)
+
+            sip = [data['sip'].get(field, np.nan) for field in HistoryStore.SIP_FIELDS]
+            fob = [data['fob'].get(field, 0) for field in HistoryStore.FOB_FIELDS]
+
+            tmp_path = output_path.with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(struct.pack('<4sHHII', b'FOB1', 1, 0, len(ladders[0]), len(ladders[1])))
+                f.write(ladders[0].tobytes())
+                f.write(ladders[1].tobytes())
+                f.write(struct.pack('<5d', *sip))
+                f.write(struct.pack('<8q', *fob))
+            tmp_path.replace(output_path)
 
-            workbook = xlrd.open_workbook(str(cftc_file))
-            data = []
+            logger.info(f"💾 {currency} → {filename}")
 
-            currency_map = {
-                'CANADIAN DOLLAR - CHICAGO MERCANTILE EXCHANGE': 'CAD',
-                'SWISS FRANC - CHICAGO MERCANTILE EXCHANGE': 'CHF',
-                'BRITISH POUND STERLING - CHICAGO MERCANTILE EXCHANGE': 'GBP',
-                'JAPANESE YEN - CHICAGO MERCANTILE EXCHANGE': 'JPY',
-                'EURO FX - CHICAGO MERCANTILE EXCHANGE': 'EUR',
-                'AUSTRALIAN DOLLAR - CHICAGO MERCANTILE EXCHANGE': 'AUD'
-            }
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения {currency}: {e}")
 
-            for sheet_name in workbook.sheet_names():
-                try:
-                    sheet = workbook.sheet_by_name(sheet_name)
-
-                    for row_idx in range(1, sheet.nrows):
-                        try:
-                            row = sheet.row(row_idx)
-                            if len(row) < 10:
-                                continue
-
-                            market_desc = str(row[0].value).strip()
-                            currency = None
-
-                            for key, curr in currency_map.items():
-                                if key in market_desc:
-                                    currency = curr
-                                    break
-
-                            if currency:
-                                date_val = int(row[1].value)
-                                date_str = f"20{date_val:06d}"
-                                formatted_date = f"{date_str[:4]}.{date_str[4:6]}.{date_str[6:]}"
-
-                                long_pos = int(float(row[8].value)) if row[8].value else 0
-                                short_pos = int(float(row[9].value)) if row[9].value else 0
-
-                                data.append({
-                                    'currency': currency,
-                                    'date': formatted_date,
-                                    'long': long_pos,
-                                    'short': short_pos
-                                })
-
-                        except Exception:
+    def export_json(self, currency: str, report_date: str) -> bool:
+        """Re-export the MT5 JSON file for a stored day from the history store"""
+        try:
+            result = self.history.to_result(currency, report_date)
+        except ImportError:
+            logger.error("❌ Модуль pyarrow не установлен")
+            return False
+
+        if result is None:
+            logger.error(f"❌ Нет истории {currency} за {report_date}")
+            return False
+
+        self._save_json(result, currency, report_date)
+        return True
+
+    def _result_filename(self, currency: str, report_date: Optional[str] = None,
+                         extension: Optional[str] = None) -> str:
+        """Name of the FOB result file for a currency and ISO date (the current trade date by default)"""
+        extension = extension or ('bin' if self.output_format == 'bin' else 'json')
+        return f"FOB_{currency}_{report_date or self.trade_day().isoformat()}.{extension}"
+
+    def backfill(self, start: datetime.date, end: datetime.date, max_workers: Optional[int] = None) -> Dict:
+        """Download, parse and compute metrics for every trading day in [start, end].
+
+        CME exports come from the download cache, so a day is never fetched twice; days whose
+        JSON results already exist are skipped, so an interrupted backfill simply resumes.
+        """
+        summary = {'days': 0, 'processed': 0, 'skipped': 0, 'failed': 0}
+
+        day = start
+        while day <= end:
+            if day.weekday() >= 5:  # Skip weekends
+                day += datetime.timedelta(days=1)
+                continue
+
+            summary['days'] += 1
+            report_date = day.isoformat()
+            trade_date = day.strftime("%Y%m%d")
+            day_dir = self.old_version_path / trade_date
+
+            pending = [c for c in self.currencies
+                       if not (self.output_path / self._result_filename(c, report_date)).exists()]
+            summary['skipped'] += len(self.currencies) - len(pending)
+
+            if pending:
+                logger.info(f"📅 {report_date}: {len(pending)} валют к обработке")
+                report = self._download_cme_batch(trade_date, day_dir, pending, max_workers)
+
+                prices = self.get_close_prices(day)
+                if not prices:
+                    logger.error(f"❌ {report_date}: нет цен, день пропущен")
+                    summary['failed'] += len(pending)
+                else:
+                    for currency in pending:
+                        if not report[currency]['success'] or currency not in prices:
+                            summary['failed'] += 1
                             continue
-                except Exception:
-                    continue
+                        if self.process_currency(currency, prices[currency], day_dir, report_date):
+                            summary['processed'] += 1
+                        else:
+                            summary['failed'] += 1
 
-            if data:
-                filename = "FinFut.json"
-                output_path = self.output_path / filename
+                shutil.rmtree(day_dir, ignore_errors=True)
 
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, indent=2, ensure_ascii=False)
+            day += datetime.timedelta(days=1)
 
-                logger.info(f"✅ CFTC: {len(data)} записей → {filename}")
+        self.cme_cache.evict()
+        self.close_price_sources()
+        logger.info(f"✅ Backfill: дней {summary['days']}, обработано {summary['processed']}, "
+                    f"пропущено {summary['skipped']}, ошибок {summary['failed']}")
+        return summary
 
-                # Cleanup
-                cftc_file.unlink()
+    def process_cftc_data(self, year: Optional[int] = None) -> bool:
+        """Merge new CFTC report dates from the cached yearly archive into the local history"""
+        try:
+            year = year or datetime.datetime.now().year
+            zip_path = self._cftc_zip_path(year)
+            if not zip_path.exists():
+                logger.warning("⚠️ CFTC файл не найден")
+                return False
+
+            output_path = self.output_path / "FinFut.json"
+            stat = zip_path.stat()
+            source_key = f"{stat.st_size}:{stat.st_mtime_ns}"
+            sources = self._load_cftc_sources()
+            if sources.get(str(year)) == source_key and output_path.exists():
+                logger.info(f"✅ CFTC {year}: новых отчетов нет")
                 return True
-            else:
+
+            # Read the XLS member into memory instead of extracting it to disk
+            with zipfile.ZipFile(zip_path) as z:
+                members = [name for name in z.namelist() if name.lower().endswith('.xls')]
+                if not members:
+                    logger.warning("⚠️ CFTC файл не найден в архиве")
+                    return False
+
+                logger.info(f"📊 Обработка CFTC: {members[0]}")
+                workbook = xlrd.open_workbook(file_contents=z.read(members[0]))
+
+            frames = [self._parse_cftc_sheet(workbook.sheet_by_name(name)) for name in workbook.sheet_names()]
+            frames = [frame for frame in frames if not frame.empty]
+            if not frames:
                 logger.error("❌ Нет данных CFTC")
                 return False
 
+            # With exact market names a repeated (currency, date) is the same report listed twice:
+            # the first occurrence in source order is kept
+            history = self._load_cftc_history()
+            parsed = pd.concat(frames, ignore_index=True).drop_duplicates(['currency', 'date'], ignore_index=True)
+            self.cftc_report['rows'] = sum(workbook.sheet_by_name(name).nrows for name in workbook.sheet_names())
+            known = pd.MultiIndex.from_frame(history[['currency', 'date']])
+            parsed_keys = pd.MultiIndex.from_frame(parsed[['currency', 'date']])
+            new_rows = parsed[~parsed_keys.isin(known)]
+
+            if not new_rows.empty:
+                # The archive's rows replace their earlier copies and keep the archive's order;
+                # archives of other years stay in front in the order they were merged
+                in_archive = known.isin(parsed_keys)
+                history = pd.concat([history[~in_archive], parsed], ignore_index=True)
+                self._save_cftc_history(history)
+
+            logger.info(f"✅ CFTC {year}: новых записей {len(new_rows)}, всего {len(history)}")
+
+            if not new_rows.empty or not output_path.exists():
+                with open(output_path, 'w', encoding='utf-8') as f:
+                    json.dump(history.to_dict('records'), f, indent=2, ensure_ascii=False)
+                logger.info(f"💾 CFTC → {output_path.name}")
+
+            sources[str(year)] = source_key
+            self._cftc_sources_path().write_text(json.dumps(sources, indent=2), encoding='utf-8')
+            return True
+
         except Exception as e:
             logger.error(f"❌ Ошибка обработки CFTC: {e}")
             return False
 
+    def update_cftc_history(self, start_year: int, end_year: Optional[int] = None) -> int:
+        """Download (if changed) and merge the yearly CFTC archives for a range of years"""
+        end_year = end_year or datetime.datetime.now().year
+        merged = 0
+        for year in range(start_year, end_year + 1):
+            if self.download_cftc_simple(year) and self.process_cftc_data(year):
+                merged += 1
+        logger.info(f"✅ CFTC история: обработано лет {merged}/{end_year - start_year + 1}")
+        return merged
+
+    def _cftc_history_path(self) -> Path:
+        """Local CFTC history indexed by (currency, report date)"""
+        return self.base_path / 'history' / 'cftc.csv'
+
+    def _cftc_sources_path(self) -> Path:
+        """Archives already merged into the CFTC history"""
+        return self.base_path / 'history' / 'cftc_sources.json'
+
+    def _load_cftc_history(self) -> pd.DataFrame:
+        """Load the CFTC history or an empty frame"""
+        path = self._cftc_history_path()
+        if not path.exists():
+            return pd.DataFrame({'currency': pd.Series(dtype=str), 'date': pd.Series(dtype=str),
+                                 'long': pd.Series(dtype=np.int64), 'short': pd.Series(dtype=np.int64)})
+        return pd.read_csv(path, dtype={'currency': str, 'date': str, 'long': np.int64, 'short': np.int64})
+
+    def _save_cftc_history(self, history: pd.DataFrame) -> None:
+        """Atomically rewrite the CFTC history file"""
+        path = self._cftc_history_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        history.to_csv(tmp_path, index=False)
+        tmp_path.replace(path)
+
+    def _load_cftc_sources(self) -> Dict:
+        """Load the merged archive registry"""
+        path = self._cftc_sources_path()
+        if not path.exists():
+            return {}
+        return json.loads(path.read_text(encoding='utf-8'))
+
+    def _parse_cftc_sheet(self, sheet) -> pd.DataFrame:
+        """Select the tracked markets of a CFTC sheet with column-wise operations"""
+        columns = ['currency', 'date', 'long', 'short']
+        if sheet.nrows < 2 or sheet.ncols < 10:
+            return pd.DataFrame(columns=columns)
+
+        markets = pd.Series(sheet.col_values(0, start_rowx=1), dtype=str).str.strip()
+        matched = markets.where(markets.isin(self.cftc_markets.keys()))
+        rows = np.flatnonzero(matched.notna().to_numpy())
+        if rows.size == 0:
+            return pd.DataFrame(columns=columns)
+
+        # Only the matching rows are converted
+        def column(colx: int) -> pd.Series:
+            return pd.to_numeric(pd.Series([sheet.cell_value(i + 1, colx) for i in rows]), errors='coerce')
+
+        dates = pd.to_datetime(column(1) + 20000000, format='%Y%m%d', errors='coerce')
+        frame = pd.DataFrame({
+            'currency': matched.iloc[rows].map(self.cftc_markets).to_numpy(),
+            'date': dates.dt.strftime('%Y.%m.%d'),
+            'long': column(8).fillna(0).astype(np.int64),
+            'short': column(9).fillna(0).astype(np.int64)
+        })
+        return frame[dates.notna()].reset_index(drop=True)
+
     def cleanup(self):
-        """Clean up temporary files"""
+        """Close the price sources and clean up temporary files"""
+        self.close_price_sources()
+        self.remove_exports()
+
+    def remove_exports(self):
+        """Remove the downloaded CME exports of the last run"""
         try:
-            # Remove temporary files
-            temp_files = ["fut_fin.zip", "fut_fin_2025.zip", "FinFutYY.xls"]
-            for temp_file in temp_files:
-                temp_path = Path(temp_file)
-                if temp_path.exists():
-                    temp_path.unlink()
-                    logger.info(f"🗑️ Удален: {temp_file}")
+            # Remove the working copies of the CME exports; the originals stay in cache/cme and
+            # the CFTC archives in cache/cftc are read in memory, so nothing else is left behind
+            for xls_file in self.old_version_path.glob('*.xls'):
+                xls_file.unlink()
+                logger.info(f"🗑️ Удален: {xls_file.name}")
 
             logger.info("✅ Очистка завершена")
 
@@ -694,6 +1614,464 @@ class SimpleOptionsProcessor:
             logger.warning(f"⚠️ Ошибка очистки: {e}")
 
 
+def process_peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of the current process in MB since it started, if the platform exposes it.
+
+    The value never decreases, so it cannot isolate one stage; the growth between two readings
+    shows how far a stage raised the process peak.
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        pass
+
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / (1024 * 1024)
+    except ImportError:
+        return None
+
+
+def rss_growth(start: Optional[float], end: Optional[float]) -> Optional[float]:
+    """Growth of the process peak RSS between two readings"""
+    return end - start if start is not None and end is not None else None
+
+
+class RunProfiler:
+    """Per-stage wall/CPU time and memory of a pipeline run, written as JSON lines.
+
+    Every record is one line in <report_dir>/pipeline_runs.jsonl tagged with the run id. With
+    profile=True the whole run is recorded by cProfile and dumped next to the report; with
+    trace_memory=True each stage also reports its own tracemalloc peak. Without it a stage only
+    has process_peak_rss_mb (the process peak so far) and peak_rss_growth_mb (how far the stage
+    raised it; 0 when it stayed below an earlier peak).
+    """
+
+    def __init__(self, report_dir: Path, profile: bool = False, trace_memory: bool = False):
+        self.report_dir = report_dir
+        self.report_dir.mkdir(parents=True, exist_ok=True)
+        self.report_path = report_dir / 'pipeline_runs.jsonl'
+        self.run_id = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.records = []
+        self.trace_memory = trace_memory
+        self.profiler = cProfile.Profile() if profile else None
+
+    def start(self):
+        """Start the optional cProfile/tracemalloc hooks"""
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.profiler:
+            self.profiler.enable()
+
+    def stop(self):
+        """Stop the hooks and dump cProfile statistics"""
+        if self.profiler:
+            self.profiler.disable()
+            profile_path = self.report_dir / f'profile_{self.run_id}.prof'
+            self.profiler.dump_stats(str(profile_path))
+            stream = io.StringIO()
+            pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(20)
+            logger.info(f"🔬 cProfile → {profile_path}\n{stream.getvalue()}")
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @contextmanager
+    def stage(self, name: str, **fields):
+        """Measure a stage; the yielded dict collects counters such as bytes or rows"""
+        record = dict(fields)
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        rss_start = process_peak_rss_mb()
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_s'] = time.perf_counter() - start
+            record['cpu_s'] = time.process_time() - cpu_start
+            record['process_peak_rss_mb'] = process_peak_rss_mb()
+            record['peak_rss_growth_mb'] = rss_growth(rss_start, record['process_peak_rss_mb'])
+            if self.trace_memory and tracemalloc.is_tracing():
+                record['tracemalloc_peak_mb'] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            self.record(name, **record)
+
+    def record(self, name: str, **fields):
+        """Append an already measured record"""
+        record = {'run_id': self.run_id, 'stage': name, **fields}
+        self.records.append(record)
+        try:
+            with open(self.report_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось записать отчет профилирования: {e}")
+
+    def wall_time(self, name: str) -> float:
+        """Total wall time of the records of a stage"""
+        return sum(r.get('wall_s', 0.0) for r in self.records if r['stage'] == name)
+
+
+class FXService:
+    """Non-interactive scheduler that keeps one warm processor (HTTP session, caches) alive.
+
+    The CME job runs every day at cme_time for the current trading date, the CFTC job after
+    the weekly release (cftc_weekday at cftc_time). Both jobs also run once at startup; a failed
+    job, or a CFTC archive that has not changed since the release time, is retried after
+    retry_minutes. The latest SIP/FOB per currency is kept in memory and written to latest.json.
+    """
+
+    def __init__(self, processor: SimpleOptionsProcessor, cme_time: str = '07:00', cftc_weekday: int = 4,
+                 cftc_time: str = '23:00', retry_minutes: float = 30, poll_seconds: float = 60,
+                 workers: Optional[int] = None, download_workers: Optional[int] = None):
+        self.processor = processor
+        self.cme_time = datetime.time.fromisoformat(cme_time)
+        self.cftc_weekday = cftc_weekday
+        self.cftc_time = datetime.time.fromisoformat(cftc_time)
+        self.retry = datetime.timedelta(minutes=retry_minutes)
+        self.poll_seconds = poll_seconds
+        # Processes for currency processing and threads for CME downloads (None: their defaults)
+        self.workers = workers
+        self.download_workers = download_workers
+        self.latest_path = processor.output_path / 'latest.json'
+        self.latest = {}
+        self._lock = threading.Lock()
+        # Trade date / release time of the last successful run and the earliest retry time per job
+        self.cme_done = None
+        self.cftc_done = None
+        self.next_retry = {'cme': None, 'cftc': None}
+        self._load_latest()
+
+    def _load_latest(self):
+        """Warm the in-memory results from latest.json, falling back to the history store"""
+        try:
+            self.latest = json.loads(self.latest_path.read_text(encoding='utf-8'))
+            return
+        except (OSError, ValueError):
+            pass
+
+        for currency in self.processor.currencies:
+            try:
+                dates = self.processor.history.dates(currency)
+                result = self.processor.history.to_result(currency, dates[-1]) if dates else None
+            except Exception as e:
+                logger.warning(f"⚠️ История {currency} недоступна: {e}")
+                continue
+            if result:
+                self.latest[currency] = {'date': dates[-1], 'sip': result['sip'], 'fob': result['fob'],
+                                         'updated_at': None}
+
+    def get_latest(self, currency: Optional[str] = None) -> Optional[Dict]:
+        """Latest SIP/FOB of a currency, or of all currencies"""
+        with self._lock:
+            if currency is None:
+                return dict(self.latest)
+            return self.latest.get(currency)
+
+    def _update_latest(self, results: Dict[str, Dict], report_date: str):
+        """Store the metrics of successfully processed currencies"""
+        updated_at = datetime.datetime.now().isoformat(timespec='seconds')
+        with self._lock:
+            for currency, result in results.items():
+                if result['success'] and result['metrics']:
+                    self.latest[currency] = {'date': report_date, 'sip': result['metrics']['sip'],
+                                             'fob': result['metrics']['fob'], 'updated_at': updated_at}
+            snapshot = json.dumps(self.latest, indent=2, default=lambda obj: obj.item())
+
+        tmp_path = self.latest_path.with_suffix('.tmp')
+        tmp_path.write_text(snapshot, encoding='utf-8')
+        tmp_path.replace(self.latest_path)
+
+    def cftc_release(self, now: datetime.datetime) -> datetime.datetime:
+        """Most recent scheduled CFTC release time not later than now"""
+        days = (now.weekday() - self.cftc_weekday) % 7
+        release = datetime.datetime.combine(now.date() - datetime.timedelta(days=days), self.cftc_time)
+        if release > now:
+            release -= datetime.timedelta(days=7)
+        return release
+
+    def _retry_pending(self, job: str, now: datetime.datetime) -> bool:
+        """Whether a failed job is still waiting for its retry time"""
+        return self.next_retry[job] is not None and now < self.next_retry[job]
+
+    def _schedule_retry(self, job: str, now: datetime.datetime):
+        """Postpone a failed job by the retry interval"""
+        self.next_retry[job] = now + self.retry
+        logger.warning(f"⚠️ {job.upper()}: повтор в {self.next_retry[job]:%H:%M}")
+
+    def run_cme(self, now: datetime.datetime) -> bool:
+        """Download, price and process the current trading date"""
+        trade_date = self.processor.get_trading_date(now=now)
+        trade_day = self.processor.trade_day(trade_date)
+        logger.info(f"⏰ CME задача за {trade_date}")
+
+        if not self.processor.download_cme_files(self.download_workers, trade_date=trade_date):
+            return False
+
+        prices = self.processor.get_close_prices(trade_day)
+        if not prices:
+            logger.error("❌ Нет цен MT5")
+            return False
+
+        results = self.processor.process_currencies(prices, self.workers, report_date=trade_day.isoformat())
+        self._update_latest(results, trade_day.isoformat())
+        # The price sources stay connected between ticks; only the exports are removed
+        self.processor.remove_exports()
+        return all(result['success'] for result in results.values())
+
+    def run_cftc(self, now: datetime.datetime, release: datetime.datetime) -> bool:
+        """Download and merge the CFTC archive; an unchanged archive after the release is not published yet"""
+        logger.info(f"⏰ CFTC задача (выпуск {release:%Y-%m-%d %H:%M})")
+        if not self.processor.download_cftc_simple(now.year) or not self.processor.process_cftc_data(now.year):
+            return False
+        if self.cftc_done is not None and self.processor.cftc_report['bytes'] == 0:
+            logger.info("⏳ CFTC еще не опубликован")
+            return False
+        return True
+
+    def tick(self, now: Optional[datetime.datetime] = None):
+        """Run the jobs that are due"""
+        now = now or datetime.datetime.now()
+
+        trade_date = self.processor.get_trading_date(now=now)
+        cme_due = self.cme_done is None or (trade_date != self.cme_done and now.time() >= self.cme_time)
+        if cme_due and not self._retry_pending('cme', now):
+            if self.run_cme(now):
+                self.cme_done = trade_date
+                self.next_retry['cme'] = None
+                logger.info(f"✅ CME за {trade_date} обработан")
+            else:
+                self._schedule_retry('cme', now)
+
+        release = self.cftc_release(now)
+        if release != self.cftc_done and not self._retry_pending('cftc', now):
+            if self.run_cftc(now, release):
+                self.cftc_done = release
+                self.next_retry['cftc'] = None
+                logger.info("✅ CFTC обновлен")
+            else:
+                self._schedule_retry('cftc', now)
+
+    def run_forever(self):
+        """Poll the schedule until interrupted"""
+        logger.info(f"🛰️ Сервис запущен: CME в {self.cme_time:%H:%M}, CFTC по дню недели "
+                    f"{self.cftc_weekday} в {self.cftc_time:%H:%M}")
+        try:
+            while True:
+                try:
+                    self.tick()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка задачи сервиса: {e}")
+                time.sleep(self.poll_seconds)
+        except KeyboardInterrupt:
+            logger.info("🛑 Сервис остановлен")
+
+
+class ResultsAPI:
+    """Read-only HTTP/JSON API over the history store, served from one in-memory copy.
+
+    Metrics and strike ladders of every currency are loaded once and reloaded only for the
+    currencies whose partitions changed (checked at most every refresh_seconds). Responses are
+    kept in an LRU cache that is cleared on reload.
+
+    GET /currencies                                  currencies and their stored dates
+    GET /latest/<CUR>                                SIP/FOB of the last stored date
+    GET /result/<CUR>/<YYYY-MM-DD>                   strike/sip/fob structure of one day
+    GET /series/<CUR>/<metric>?start=&end=           time series of a SIP/FOB field or close_price
+    GET /strikes/<CUR>?date=&low=&high=&side=        strikes whose price is within [low, high]
+    """
+
+    def __init__(self, processor: SimpleOptionsProcessor, refresh_seconds: float = 60, cache_size: int = 256):
+        self.processor = processor
+        self.history = processor.history
+        self.refresh_seconds = refresh_seconds
+        self.cache_size = cache_size
+        self.metrics = {}
+        self.strikes = {}
+        self._signatures = {}
+        self._responses = OrderedDict()
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def _signature(self, currency: str) -> tuple:
+        """Stored dates of a currency with the modification times of their partitions"""
+        path = self.history.root / 'metrics' / f"currency={currency}"
+        return tuple(sorted((part.parent.name, part.stat().st_mtime_ns)
+                            for part in path.glob('date=*/part-0.parquet')))
+
+    def refresh(self, force: bool = False) -> List[str]:
+        """Reload the currencies whose partitions changed; returns their names"""
+        with self._lock:
+            if not force and time.monotonic() - self._checked_at < self.refresh_seconds:
+                return []
+            self._checked_at = time.monotonic()
+
+            reloaded = []
+            for currency in self.processor.currencies:
+                signature = self._signature(currency)
+                if signature == self._signatures.get(currency):
+                    continue
+                try:
+                    self.metrics[currency] = self.history.load(currency, 'metrics')
+                    self.strikes[currency] = self.history.load(currency, 'strikes')
+                except Exception as e:
+                    logger.error(f"❌ Ошибка загрузки истории {currency}: {e}")
+                    continue
+                self._signatures[currency] = signature
+                reloaded.append(currency)
+
+            if reloaded:
+                self._responses.clear()
+                logger.info(f"🔄 API: загружены {', '.join(reloaded)}")
+            return reloaded
+
+    def handle(self, path: str, query: Dict[str, List[str]]) -> tuple:
+        """Answer a request with (status, JSON bytes), using the response cache"""
+        self.refresh()
+        key = path + '?' + '&'.join(f"{k}={v[0]}" for k, v in sorted(query.items()))
+        with self._lock:
+            if key in self._responses:
+                self._responses.move_to_end(key)
+                return self._responses[key]
+
+        try:
+            status, body = 200, self._route(path.strip('/').split('/'), {k: v[0] for k, v in query.items()})
+        except KeyError as e:
+            status, body = 404, {'error': f"не найдено: {e.args[0]}"}
+        except ValueError as e:
+            status, body = 400, {'error': str(e)}
+
+        response = (status, json.dumps(body, ensure_ascii=False, default=lambda obj: obj.item()).encode('utf-8'))
+        if status == 200:
+            with self._lock:
+                self._responses[key] = response
+                while len(self._responses) > self.cache_size:
+                    self._responses.popitem(last=False)
+        return response
+
+    def _frame(self, frames: Dict[str, pd.DataFrame], currency: str) -> pd.DataFrame:
+        """Loaded frame of a currency; KeyError if there is no data"""
+        frame = frames.get(currency.upper())
+        if frame is None or frame.empty:
+            raise KeyError(currency)
+        return frame
+
+    def _route(self, parts: List[str], params: Dict[str, str]):
+        """Dispatch a path to its query"""
+        if parts == ['currencies']:
+            return {currency: frame['date'].tolist() for currency, frame in self.metrics.items() if not frame.empty}
+        if len(parts) == 2 and parts[0] == 'latest':
+            return self.latest(parts[1])
+        if len(parts) == 3 and parts[0] == 'result':
+            return self.result(parts[1], parts[2])
+        if len(parts) == 3 and parts[0] == 'series':
+            return self.series(parts[1], parts[2], params.get('start'), params.get('end'))
+        if len(parts) == 2 and parts[0] == 'strikes':
+            return self.strikes_in_band(parts[1], params.get('date'), params.get('low'), params.get('high'),
+                                        params.get('side'))
+        raise KeyError('/'.join(parts))
+
+    def latest(self, currency: str) -> Dict:
+        """SIP/FOB of the last stored date"""
+        row = self._frame(self.metrics, currency).iloc[-1]
+        return {
+            'currency': currency.upper(),
+            'date': row['date'],
+            'close_price': row['close_price'],
+            'sip': {field: row[field] for field in HistoryStore.SIP_FIELDS},
+            'fob': {field: row[field] for field in HistoryStore.FOB_FIELDS}
+        }
+
+    def result(self, currency: str, report_date: str) -> Dict:
+        """The MT5 result structure of one day"""
+        metrics = self._frame(self.metrics, currency)
+        row = metrics[metrics['date'] == report_date]
+        if row.empty:
+            raise KeyError(report_date)
+        row = row.iloc[0]
+
+        strikes = self._frame(self.strikes, currency)
+        strikes = strikes[strikes['date'] == report_date]
+        return {
+            'strike': {key: self._strike_rows(strikes[strikes['side'] == side])
+                       for side, key in (('call', 'calls'), ('put', 'puts'))},
+            'sip': {field: row[field] for field in HistoryStore.SIP_FIELDS},
+            'fob': {field: row[field] for field in HistoryStore.FOB_FIELDS}
+        }
+
+    def series(self, currency: str, metric: str, start: Optional[str] = None, end: Optional[str] = None) -> List[Dict]:
+        """Values of one metric by date"""
+        if metric not in ['close_price'] + HistoryStore.SIP_FIELDS + HistoryStore.FOB_FIELDS:
+            raise ValueError(f"неизвестная метрика: {metric}")
+        metrics = self._frame(self.metrics, currency)
+        if start:
+            metrics = metrics[metrics['date'] >= start]
+        if end:
+            metrics = metrics[metrics['date'] <= end]
+        return [{'date': date, 'value': value} for date, value in zip(metrics['date'], metrics[metric])]
+
+    def strikes_in_band(self, currency: str, report_date: Optional[str] = None, low: Optional[str] = None,
+                        high: Optional[str] = None, side: Optional[str] = None) -> Dict:
+        """Strikes of one day (the last one by default) whose price lies within [low, high]"""
+        strikes = self._frame(self.strikes, currency)
+        report_date = report_date or strikes['date'].iloc[-1]
+        mask = strikes['date'] == report_date
+        if not mask.any():
+            raise KeyError(report_date)
+        if low is not None:
+            mask &= strikes['price'] >= float(low)
+        if high is not None:
+            mask &= strikes['price'] <= float(high)
+        if side is not None:
+            if side not in ('call', 'put'):
+                raise ValueError(f"side должен быть call или put: {side}")
+            mask &= strikes['side'] == side
+
+        selected = strikes[mask]
+        return {
+            'currency': currency.upper(),
+            'date': report_date,
+            'calls': self._strike_rows(selected[selected['side'] == 'call']),
+            'puts': self._strike_rows(selected[selected['side'] == 'put'])
+        }
+
+    @staticmethod
+    def _strike_rows(frame: pd.DataFrame) -> List[Dict]:
+        """Strike rows in the MT5 JSON layout"""
+        return [{"price": float(price), "strike": int(at_close), "delta": int(change)}
+                for price, at_close, change in zip(frame['price'], frame['at_close'], frame['change'])]
+
+    def serve(self, host: str = '127.0.0.1', port: int = 8765) -> ThreadingHTTPServer:
+        """Create the HTTP server; call serve_forever() on it (in a thread if needed)"""
+        server = ThreadingHTTPServer((host, port), ResultsRequestHandler)
+        server.api = self
+        logger.info(f"🌐 API: http://{host}:{server.server_address[1]}/")
+        return server
+
+
+class ResultsRequestHandler(BaseHTTPRequestHandler):
+    """GET-only handler delegating to server.api"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            status, body = self.server.api.handle(url.path, parse_qs(url.query))
+        except Exception as e:
+            logger.error(f"❌ API {url.path}: {e}")
+            status, body = 500, json.dumps({'error': 'внутренняя ошибка'}, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"API {self.address_string()} {format % args}")
+
+
 def format_duration(seconds: float) -> str:
     """Format duration"""
     if seconds < 60:
@@ -706,110 +2084,123 @@ def format_duration(seconds: float) -> str:
         return f"{hours}ч {minutes}м"
 
 
-def main():
+def price_sources(price_file: Optional[str] = None) -> Optional[List[PriceSource]]:
+    """A CSV file of close prices takes precedence over MT5"""
+    if price_file:
+        return [CSVPriceSource(Path(price_file)), MT5PriceSource()]
+    return None
+
+
+def main(workers: Optional[int] = None, profile: bool = False, trace_memory: bool = False,
+         output_format: str = 'json', price_file: Optional[str] = None, instruments: Optional[str] = None,
+         use_xlsx: bool = False, download_workers: Optional[int] = None):
     """Main function"""
     start_time = time.time()
+    profiler = RunProfiler(Path.cwd() / 'reports', profile=profile, trace_memory=trace_memory)
+    profiler.start()
 
     try:
         print("\n" + "🚀 ОБРАБОТЧИК ОПЦИОННЫХ ДАННЫХ")
         print("=" * 60)
 
         # Initialize processor
-        processor = SimpleOptionsProcessor()
+        processor = SimpleOptionsProcessor(output_format, price_sources(price_file), instruments)
         processor.show_info()
 
-        # Step 1: Download CME files
-        step_time = time.time()
-        if not processor.download_cme_files():
-            logger.error("❌ Ошибка загрузки CME")
-            return False
-        cme_time = time.time() - step_time
+        # Step 1: Download CME files; the trade date keys the prices and every output of the run
+        trade_date = processor.get_trading_date()
+        trade_day = processor.trade_day(trade_date)
+        with profiler.stage('cme_download') as stage:
+            cme_success = processor.download_cme_files(download_workers, trade_date=trade_date)
+            stage['bytes'] = sum(r.get('bytes', 0) for r in processor.download_report.values())
+            stage['currencies'] = {c: r['success'] for c, r in processor.download_report.items()}
+        if not cme_success:
+            if not use_xlsx:
+                logger.error("❌ Ошибка загрузки CME")
+                return False
+            logger.warning("⚠️ CME не загружен, используются XLSX файлы")
 
         # Step 2: Download CFTC (optional)
-        step_time = time.time()
         print("\n📊 Загрузка данных CFTC")
         choice = input("Загрузить CFTC данные? (y/n, по умолчанию y): ").strip().lower()
 
         cftc_success = False
-        if not choice or choice.startswith('y'):
-            cftc_success = processor.download_cftc_simple()
-        else:
-            logger.info("⏭️ Пропуск CFTC данных")
+        with profiler.stage('cftc_download') as stage:
+            if not choice or choice.startswith('y'):
+                cftc_success = processor.download_cftc_simple()
+            else:
+                logger.info("⏭️ Пропуск CFTC данных")
+            stage['bytes'] = processor.cftc_report['bytes']
 
-        cftc_time = time.time() - step_time
+        # Step 3: Get prices
+        with profiler.stage('prices'):
+            logger.info("💹 Получение цен...")
 
-        # Step 3: Convert files
-        step_time = time.time()
-        if not processor.convert_files():
-            logger.error("❌ Ошибка конвертации")
-            return False
-        convert_time = time.time() - step_time
+            prices = processor.get_close_prices(trade_day)
+            if not prices:
+                print("\n🔄 MT5 недоступен. Выберите альтернативу:")
+                print("1. ✏️  Ввести цены вручную")
+                print("2. 📊 Использовать примерные цены")
 
-        # Step 4: Get prices
-        step_time = time.time()
-        logger.info("💹 Получение цен...")
-
-        prices = processor.get_close_prices()
-        if not prices:
-            print("\n🔄 MT5 недоступен. Выберите альтернативу:")
-            print("1. ✏️  Ввести цены вручную")
-            print("2. 📊 Использовать примерные цены")
-
-            while True:
-                try:
-                    choice = input("\nВыберите (1-2, по умолчанию 2): ").strip()
-                    if not choice or choice == "2":
-                        prices = processor.get_alternative_prices()
-                        break
-                    elif choice == "1":
-                        prices = processor.get_manual_prices()
-                        if prices:
+                while True:
+                    try:
+                        choice = input("\nВыберите (1-2, по умолчанию 2): ").strip()
+                        if not choice or choice == "2":
+                            prices = processor.get_alternative_prices()
                             break
-                    else:
-                        print("❌ Неверный выбор")
-                        continue
-                except KeyboardInterrupt:
-                    logger.info("🛑 Отмена")
-                    return False
+                        elif choice == "1":
+                            prices = processor.get_manual_prices()
+                            if prices:
+                                break
+                        else:
+                            print("❌ Неверный выбор")
+                            continue
+                    except KeyboardInterrupt:
+                        logger.info("🛑 Отмена")
+                        return False
 
         if not prices:
             logger.error("❌ Нет цен для обработки")
             return False
 
-        prices_time = time.time() - step_time
-
-        # Step 5: Process currencies
-        step_time = time.time()
+        # Step 4: Process currencies
         currencies = list(processor.currencies.keys())
-        processed = 0
-
-        for i, currency in enumerate(currencies):
-            if processor.process_currency(currency, prices[i]):
-                processed += 1
-
-        process_time = time.time() - step_time
-
-        # Step 6: Process CFTC if downloaded
+        with profiler.stage('process') as stage:
+            results = processor.process_currencies(prices, workers, use_xlsx, trade_day.isoformat())
+            stage['rows'] = sum(result['rows'] for result in results.values())
+        processed = sum(1 for result in results.values() if result['success'])
+
+        for currency, result in results.items():
+            profiler.record('process_currency', currency=currency, success=result['success'],
+                            wall_s=result['elapsed'], cpu_s=result['cpu'], rows=result['rows'],
+                            unchanged=result['unchanged'], process_peak_rss_mb=result['process_peak_rss_mb'],
+                            peak_rss_growth_mb=result['peak_rss_growth_mb'], error=result['error'])
+
+        # Step 5: Process CFTC if downloaded
         if cftc_success:
-            processor.process_cftc_data()
+            with profiler.stage('cftc_process') as stage:
+                processor.process_cftc_data()
+                stage['rows'] = processor.cftc_report['rows']
 
         # Results
         total_time = time.time() - start_time
+        profiler.record('total', wall_s=total_time, process_peak_rss_mb=process_peak_rss_mb(),
+                        processed=processed, currencies=len(currencies))
 
         print(f"\n🎉 ЗАВЕРШЕНО!")
         print("=" * 40)
         print(f"⏱️ Общее время: {format_duration(total_time)}")
-        print(f"📥 CME: {format_duration(cme_time)}")
-        print(f"📊 CFTC: {format_duration(cftc_time)}")
-        print(f"🔄 Конвертация: {format_duration(convert_time)}")
-        print(f"💹 Цены: {format_duration(prices_time)}")
-        print(f"⚙️ Обработка: {format_duration(process_time)}")
+        print(f"📥 CME: {format_duration(profiler.wall_time('cme_download'))}")
+        print(f"📊 CFTC: {format_duration(profiler.wall_time('cftc_download'))}")
+        print(f"💹 Цены: {format_duration(profiler.wall_time('prices'))}")
+        print(f"⚙️ Обработка: {format_duration(profiler.wall_time('process'))}")
         print(f"✅ Успешно: {processed}/{len(currencies)}")
 
         processor.show_info()
         processor.cleanup()
 
         print(f"\n💾 Результаты: {processor.output_path}")
+        print(f"📈 Отчет профилирования: {profiler.report_path}")
 
         return True
 
@@ -821,7 +2212,91 @@ def main():
         elapsed = time.time() - start_time
         logger.error(f"❌ Критическая ошибка после {format_duration(elapsed)}: {e}")
         return False
+    finally:
+        profiler.stop()
+
+
+def run_backfill(start: str, end: str, output_format: str = 'json', price_file: Optional[str] = None,
+                 instruments: Optional[str] = None, download_workers: Optional[int] = None) -> bool:
+    """Backfill metrics for a date range (YYYY-MM-DD)"""
+    start_time = time.time()
+
+    try:
+        start_date = datetime.date.fromisoformat(start)
+        end_date = datetime.date.fromisoformat(end)
+        if start_date > end_date:
+            logger.error("❌ Начальная дата позже конечной")
+            return False
+
+        print(f"\n📅 ИСТОРИЧЕСКАЯ ЗАГРУЗКА {start_date} — {end_date}")
+        print("=" * 60)
+
+        processor = SimpleOptionsProcessor(output_format, price_sources(price_file), instruments)
+        summary = processor.backfill(start_date, end_date, download_workers)
+
+        print(f"\n⏱️ Общее время: {format_duration(time.time() - start_time)}")
+        print(f"✅ Обработано: {summary['processed']}, пропущено: {summary['skipped']}, "
+              f"ошибок: {summary['failed']}")
+        return summary['failed'] == 0
+
+    except ValueError as e:
+        logger.error(f"❌ Неверная дата: {e}")
+        return False
+    except KeyboardInterrupt:
+        print(f"\n🛑 Прервано после {format_duration(time.time() - start_time)}, "
+              f"повторный запуск продолжит с места остановки")
+        return False
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Обработчик опционных данных CME/CFTC")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Число процессов для обработки валют (по умолчанию число ядер, 1 - без пула)")
+    parser.add_argument('--download-workers', type=int, default=None,
+                        help="Число потоков загрузки CME (по умолчанию по числу валют, не более 8)")
+    parser.add_argument('--output-format', choices=['json', 'min', 'bin'], default='json',
+                        help="Формат результатов: json (с отступами), min (компактный JSON), bin (бинарный)")
+    parser.add_argument('--profile', action='store_true',
+                        help="Записать профиль cProfile для всего запуска")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="Отслеживать пиковое потребление памяти по этапам (tracemalloc)")
+    parser.add_argument('--cftc-years', nargs='+', type=int, metavar='YEAR',
+                        help="Дополнить историю CFTC за годы (START [END])")
+    parser.add_argument('--backfill', nargs=2, metavar=('START', 'END'),
+                        help="Загрузить и обработать историю за период (YYYY-MM-DD YYYY-MM-DD)")
+    parser.add_argument('--instruments', metavar='JSON', default=None,
+                        help="Реестр инструментов (по умолчанию instruments.json рядом со скриптом)")
+    parser.add_argument('--prices', metavar='CSV', default=None,
+                        help="CSV с ценами закрытия (date,symbol,close), используется раньше MT5")
+    parser.add_argument('--service', action='store_true',
+                        help="Работать как сервис: CME после каждого торгового дня, CFTC еженедельно")
+    parser.add_argument('--cme-time', default='07:00', help="Время ежедневной загрузки CME (HH:MM)")
+    parser.add_argument('--cftc-time', default='23:00', help="Время загрузки CFTC в пятницу (HH:MM)")
+    parser.add_argument('--api-port', type=int, default=None,
+                        help="Запустить API результатов на порту (вместе с --service работает в фоне)")
+    parser.add_argument('--api-host', default='127.0.0.1', help="Адрес API результатов")
+    parser.add_argument('--xlsx', action='store_true',
+                        help="Использовать XLSX из 'new version' для валют без загруженного XLS")
+    args = parser.parse_args()
+
+    if args.cftc_years:
+        SimpleOptionsProcessor(instruments_path=args.instruments).update_cftc_history(*args.cftc_years[:2])
+    elif args.backfill:
+        run_backfill(*args.backfill, output_format=args.output_format, price_file=args.prices,
+                     instruments=args.instruments, download_workers=args.download_workers)
+    elif args.service:
+        processor = SimpleOptionsProcessor(args.output_format, price_sources(args.prices), args.instruments)
+        if args.api_port is not None:
+            server = ResultsAPI(processor).serve(args.api_host, args.api_port)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        FXService(processor, cme_time=args.cme_time, cftc_time=args.cftc_time,
+                  workers=args.workers, download_workers=args.download_workers).run_forever()
+    elif args.api_port is not None:
+        try:
+            ResultsAPI(SimpleOptionsProcessor(instruments_path=args.instruments)).serve(args.api_host, args.api_port).serve_forever()
+        except KeyboardInterrupt:
+            logger.info("🛑 API остановлен")
+    else:
+        main(workers=args.workers, profile=args.profile, trace_memory=args.trace_memory,
+             output_format=args.output_format, price_file=args.prices, instruments=args.instruments,
+             use_xlsx=args.xlsx, download_workers=args.download_workers)
\ No newline at end of file
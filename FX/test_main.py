@@ -0,0 +1,77 @@
+"""Tests for SimpleOptionsProcessor on synthetic CME data.
+
+Usage: python -m unittest test_main (needs xlwt to write the XLS fixtures and pyarrow for history)
+"""
+import os
+import json
+import datetime
+import tempfile
+import unittest
+from pathlib import Path
+
+from benchmark import make_cme_rows, write_cme_xls
+from main import SimpleOptionsProcessor, CSVPriceSource, FXService
+
+
+class SameTradeDateTest(unittest.TestCase):
+    """A daily run and a backfill of one CME trade date share every date key"""
+
+    NOW = datetime.datetime(2025, 7, 8, 8, 0)  # Tuesday: trade date 2025-07-04 (Friday)
+    TRADE_DATE = '20250704'
+    REPORT_DATE = '2025-07-04'
+
+    def setUp(self):
+        try:
+            import pyarrow  # noqa: F401
+            import xlwt  # noqa: F401
+        except ImportError as e:
+            self.skipTest(f"нет модуля {e.name}")
+
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(os.chdir, self.cwd)
+        root = Path(self.tmp.name)
+
+        instruments = json.loads((Path(__file__).with_name('instruments.json')).read_text(encoding='utf-8'))
+        (root / 'instruments.json').write_text(json.dumps({'EUR': instruments['EUR']}), encoding='utf-8')
+        # The close of the trade date and a later bar that a "last closed bar" lookup would pick
+        (root / 'prices.csv').write_text(f"date,symbol,close\n{self.REPORT_DATE},EURUSD,0.9100\n"
+                                         "2025-07-07,EURUSD,0.9200\n", encoding='utf-8')
+
+        self.processor = SimpleOptionsProcessor(price_sources=[CSVPriceSource(root / 'prices.csv')],
+                                                instruments_path=root / 'instruments.json')
+        # Serve the export from the download cache instead of the network
+        xls_path = root / 'EUR.xls'
+        self.assertTrue(write_cme_xls(make_cme_rows(50), xls_path))
+        self.processor.cme_cache.put('58', self.TRADE_DATE, 'P', xls_path.read_bytes())
+
+    def assert_single_day(self):
+        processor = self.processor
+        self.assertEqual(processor.history.dates('EUR'), [self.REPORT_DATE])
+        self.assertEqual([p.name for p in processor.output_path.glob('FOB_EUR_*')], [f"FOB_EUR_{self.REPORT_DATE}.json"])
+        self.assertEqual(processor.changes.load('EUR')['report_date'], self.REPORT_DATE)
+        metrics = processor.history.load('EUR')
+        self.assertEqual(metrics['close_price'].tolist(), [processor.quote_to_price('EUR', 0.9100)])
+
+    def test_daily_run_then_backfill(self):
+        service = FXService(self.processor)
+        self.assertTrue(service.run_cme(self.NOW))
+        self.assertEqual(service.get_latest('EUR')['date'], self.REPORT_DATE)
+
+        summary = self.processor.backfill(datetime.date(2025, 7, 4), datetime.date(2025, 7, 4))
+        self.assertEqual(summary['skipped'], 1)
+        self.assert_single_day()
+
+    def test_backfill_then_daily_run(self):
+        summary = self.processor.backfill(datetime.date(2025, 7, 4), datetime.date(2025, 7, 4))
+        self.assertEqual(summary['processed'], 1)
+
+        service = FXService(self.processor)
+        self.assertTrue(service.run_cme(self.NOW))
+        self.assert_single_day()
+
+
+if __name__ == '__main__':
+    unittest.main()